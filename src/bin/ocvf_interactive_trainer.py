@@ -66,6 +66,7 @@ class Trainer(object):
         self.training_data_path = _options.training_data_path
         self.training_image_number = _options.training_image_number
         self.cascade_filename = _options.cascade_filename
+        self.incremental = _options.incremental
         try:
             self.image_size = (int(_options.image_size.split("x")[0]), int(_options.image_size.split("x")[1]))
         except Exception, e:
@@ -116,7 +117,14 @@ class Trainer(object):
                 if train_name is not "":
                     print ">> Training for '%s' (run %d)" % (train_name, self.counter)
                     if self.record_images(train_name):
-                        self.re_train()
+                        if self.incremental and os.path.exists(self.model_path):
+                            try:
+                                self.enroll(train_name)
+                            except ValueError, e:
+                                print ">> Unable to Enroll (%s), Re-Training Instead" % e
+                                self.re_train()
+                        else:
+                            self.re_train()
                         self.restart_classifier()
                         self.counter += 1
                     else:
@@ -196,15 +204,28 @@ class Trainer(object):
             print ">> No Persons Found for Re-Training"
             return
 
-        trainer = TheTrainer(self.training_data_path, self.image_size, self.model_path, _numfolds=options.numfolds)
+        trainer = TheTrainer(self.training_data_path, self.image_size, self.model_path, _numfolds=options.numfolds,
+                             _num_processes=options.num_processes)
 
-        [images, labels, subject_names] = trainer.read_images(self.training_data_path, self.image_size)
+        data = trainer.read_images(self.training_data_path, self.image_size, cache=True,
+                                   num_workers=trainer.num_workers)
+        [images, labels, subject_names] = data
 
         if len(labels) == 0:
             self.doRun = False
             raise Exception(">> No Images in Folder %s" % self.training_data_path)
         else:
-            trainer.train()
+            # The images are read already, don't read them again
+            trainer.train(data)
+
+    def enroll(self, train_name):
+        print ">> Enrolling '%s' Without Re-Training.." % train_name
+        person_image_path = os.path.join(self.training_data_path, train_name)
+        images = [cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+                  for filename in sorted(glob.glob(os.path.join(person_image_path, '*.*')))]
+        images = [im for im in images if im is not None]
+        trainer = TheTrainer(self.training_data_path, self.image_size, self.model_path)
+        trainer.enroll(train_name, images)
 
     def restart_classifier(self):
         print ">> Restarting Recognizer"
@@ -244,8 +265,12 @@ if __name__ == '__main__':
                                help="Resizes the given and new dataset(s) to a given size in format [width]x[height] (default: %default).")
     group_algorithm.add_option("-v", "--validate", action="store", dest="numfolds", type="int", default=None,
                                help="Performs a k-fold cross validation on the dataset, if given (default: %default).")
+    group_algorithm.add_option("-j", "--processes", action="store", dest="num_processes", type="int", default=1,
+                               help="Number of processes validating the folds in parallel (default: %default).")
     group_algorithm.add_option("-c", "--cascade", action="store", dest="cascade_filename",
                                help="Sets the path to the HaarCascade file used for the face detection algorithm [haarcascade_frontalface_alt2.xml].")
+    group_algorithm.add_option("-i", "--incremental", action="store_true", dest="incremental", default=False,
+                               help="Adds new persons to the existing model instead of re-training it (default: %default).")
     group_algorithm.add_option("-l", "--mugshot-size", action="store", type="int", dest="mugshot_size", default=100,
                                help="Sets minimal size (in pixels) required for a mugshot of a person in order to use it for training (default: %default).")
 
@@ -94,6 +94,8 @@ if __name__ == '__main__':
                       help="Resizes the given dataset to a given size in format [width]x[height] (default: 70x70).")
     parser.add_option("-v", "--validate", action="store", dest="numfolds", type="int", default=None,
                       help="Performs a k-fold cross validation on the dataset, if given (default: None).")
+    parser.add_option("-j", "--processes", action="store", dest="num_processes", type="int", default=1,
+                      help="Number of processes validating the folds in parallel (default: 1).")
     parser.add_option("-t", "--train", action="store", dest="dataset", type="string", default=None,
                       help="Trains the model on the given dataset.")
     parser.add_option("-i", "--id", action="store", dest="camera_id", type="int", default=0,
@@ -136,7 +138,8 @@ if __name__ == '__main__':
             sys.exit(1)
             # Reads the images, labels and folder_names from a given dataset. Images
 
-        trainer = TheTrainer(options.dataset, image_size, model_filename, _numfolds=options.numfolds)
+        trainer = TheTrainer(options.dataset, image_size, model_filename, _numfolds=options.numfolds,
+                             _num_processes=options.num_processes)
         trainer.train()
 
     print ">> Loading model " + str(model_filename)
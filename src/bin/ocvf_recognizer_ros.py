@@ -59,6 +59,7 @@ from ocvfacerec.trainer.thetrainer import TheTrainer
 from ocvfacerec.facerec.serialization import load_model
 from ocvfacerec.facedet.detector import CascadedDetector
 from ocvfacerec.trainer.thetrainer import ExtendedPredictableModel
+from ocvfacerec.helper.ModelLoader import ModelLoader
 
 
 class RosPeople:
@@ -73,13 +74,15 @@ def ros_spinning(message="None"):
 
 
 class Recognizer(object):
-    def __init__(self, model, cascade_filename, run_local, wait, rp):
+    def __init__(self, model, cascade_filename, run_local, wait, rp, model_filename=None):
         self.rp = rp
         self.wait = wait
         self.doRun = True
         self.model = model
-        self.restart = False
-        self.ros_restart_request = False
+        # Retrained models are loaded in the background and swapped in between frames
+        self.model_loader = None
+        if model_filename is not None:
+            self.model_loader = ModelLoader(model_filename)
         self.detector = CascadedDetector(cascade_fn=cascade_filename, minNeighbors=5, scaleFactor=1.1)
         if run_local:
             print ">> Error: Run local selected in ROS based Recognizer"
@@ -105,6 +108,10 @@ class Recognizer(object):
         # img = cv2.resize(cv_image, (cv_image.shape[1] / 2, cv_image.shape[0] / 2), interpolation=cv2.INTER_CUBIC)
         # img = cv_image
         imgout = img.copy()
+        # Use a newly loaded model from now on, the whole frame is processed with one model
+        if self.model_loader is not None:
+            self.model = self.model_loader.swap(self.model)
+        model = self.model
         # Remember the Persons found in current image
         persons = []
         for _i, r in enumerate(self.detector.detect(img)):
@@ -112,8 +119,8 @@ class Recognizer(object):
             # (1) Get face, (2) Convert to grayscale & (3) resize to image_size:
             face = img[y0:y1, x0:x1]
             face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
-            face = cv2.resize(face, self.model.image_size, interpolation=cv2.INTER_CUBIC)
-            prediction = self.model.predict(face)
+            face = cv2.resize(face, model.image_size, interpolation=cv2.INTER_CUBIC)
+            prediction = model.predict(face)
             predicted_label = prediction[0]
             classifier_output = prediction[1]
             # Now let's get the distance from the assuming a 1-Nearest Neighbor.
@@ -122,7 +129,7 @@ class Recognizer(object):
             # Draw the face area in image:
             cv2.rectangle(imgout, (x0, y0), (x1, y1), (0, 0, 255), 2)
             # Draw the predicted name (folder name...):
-            draw_str(imgout, (x0 - 20, y0 - 40), "Label " + self.model.subject_names[predicted_label])
+            draw_str(imgout, (x0 - 20, y0 - 40), "Label " + model.subject_names[predicted_label])
             draw_str(imgout, (x0 - 20, y0 - 20), "Feature Distance " + "%1.1f" % distance)
             msg = Person()
             point = Point()
@@ -134,7 +141,7 @@ class Recognizer(object):
             # Z is "mis-used" to represent the size of the bounding box
             point.z = x1 - x0
             msg.position = point
-            msg.name = str(self.model.subject_names[predicted_label])
+            msg.name = str(model.subject_names[predicted_label])
             msg.reliability = float(distance)
             persons.append(msg)
         if len(persons) > 0:
@@ -149,18 +156,11 @@ class Recognizer(object):
         cv2.imshow('OCVFACEREC < ROS STREAM', imgout)
         cv2.waitKey(self.wait)
 
-        try:
-            z = self.ros_restart_request
-            if z:
-                self.restart = True
-                self.doRun = False
-        except Exception, e:
-            pass
-
     def restart_callback(self, ros_data):
         print ">> Received Restart Request"
-        if "restart" in str(ros_data):
-            self.ros_restart_request = True
+        # The current model is used until the new one is loaded
+        if "restart" in str(ros_data) and self.model_loader is not None:
+            self.model_loader.request_reload()
 
     def run_distributed(self, image_topic, restart_topic):
         print ">> Activating ROS Subscriber"
@@ -170,7 +170,7 @@ class Recognizer(object):
         while self.doRun:
             time.sleep(0.01)
             pass
-        # Important: You need to unregister before restarting!
+        # Important: You need to unregister before exiting!
         image_subscriber.unregister()
         restart_subscriber.unregister()
         print ">> Deactivating ROS Subscriber"
@@ -187,6 +187,8 @@ if __name__ == '__main__':
                       help="Resizes the given dataset to a given size in format [width]x[height] (default: 70x70).")
     parser.add_option("-v", "--validate", action="store", dest="numfolds", type="int", default=None,
                       help="Performs a k-fold cross validation on the dataset, if given (default: None).")
+    parser.add_option("-j", "--processes", action="store", dest="num_processes", type="int", default=1,
+                      help="Number of processes validating the folds in parallel (default: 1).")
     parser.add_option("-t", "--train", action="store", dest="dataset", type="string", default=None,
                       help="Trains the model on the given dataset.")
     parser.add_option("-c", "--cascade", action="store", dest="cascade_filename",
@@ -227,7 +229,8 @@ if __name__ == '__main__':
         sys.exit(1)
     # We got a dataset to learn a new model from:
     if options.dataset:
-        trainer = TheTrainer(options.dataset, image_size, model_filename, _numfolds=options.numfolds)
+        trainer = TheTrainer(options.dataset, image_size, model_filename, _numfolds=options.numfolds,
+                             _num_processes=options.num_processes)
         trainer.train()
 
     print ">> Loading Model <-- " + str(model_filename)
@@ -246,11 +249,5 @@ if __name__ == '__main__':
     rp = RosPeople()
     start_new_thread(ros_spinning, ("None",))
     x = Recognizer(model=model, cascade_filename=options.cascade_filename, run_local=False,
-                   wait=options.wait_time, rp=rp)
-    x.run_distributed(str(options.ros_source), str(options.restart_notification))
-    while x.restart:
-        time.sleep(1)
-        model = load_model(model_filename)
-        x = Recognizer(model=model, cascade_filename=options.cascade_filename, run_local=False,
-                       wait=options.wait_time, rp=rp)
-        x.run_distributed(str(options.ros_source), str(options.restart_notification))
\ No newline at end of file
+                   wait=options.wait_time, rp=rp, model_filename=model_filename)
+    x.run_distributed(str(options.ros_source), str(options.restart_notification))
\ No newline at end of file
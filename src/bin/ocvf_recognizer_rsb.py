@@ -49,6 +49,7 @@ import numpy as np
 from ocvfacerec.facedet.detector import CascadedDetector
 from ocvfacerec.facerec.serialization import load_model
 from ocvfacerec.helper.PersonWrapper import PersonWrapper
+from ocvfacerec.helper.ModelLoader import ModelLoader
 from ocvfacerec.helper.common import *
 from ocvfacerec.trainer.thetrainer import ExtendedPredictableModel
 from ocvfacerec.trainer.thetrainer import TheTrainer
@@ -61,8 +62,12 @@ class Recognizer(object):
 
     def __init__(self, model, camera_id, cascade_filename, run_local, inscope="/rsbopencv/ipl",
                  outscope="/ocvfacerec/rsb/people", wait=50, notification="/ocvfacerec/rsb/restart/",
-                 show_gui=False):
+                 show_gui=False, model_filename=None):
         self.model = model
+        # Retrained models are loaded in the background and swapped in between frames
+        self.model_loader = None
+        if model_filename is not None:
+            self.model_loader = ModelLoader(model_filename)
         self.wait = wait
         self.notification_scope = notification
         self.show_gui = show_gui
@@ -73,7 +78,6 @@ class Recognizer(object):
             sys.exit(1)
 
         self.doRun = True
-        self.restart = False
 
         def signal_handler(signal, frame):
             print "\n>> RSB Exiting"
@@ -145,6 +149,10 @@ class Recognizer(object):
         while self.doRun:
             # GetLastImage is blocking so we won't get a "None" Image
             image, cause_uuid = self.lastImage.get(True)
+            # Use a newly loaded model from now on, the whole frame is processed with one model
+            if self.model_loader is not None:
+                self.model = self.model_loader.swap(self.model)
+            model = self.model
             # This should not be resized with a fixed rate, this should be rather configured by the sender
             # i.e. by sending smaller images. Don't fiddle with input data in two places.
             # img = cv2.resize(image, (image.shape[1] / 2, image.shape[0] / 2), interpolation=cv2.INTER_CUBIC)
@@ -158,17 +166,17 @@ class Recognizer(object):
                 # (1) Get face, (2) Convert to grayscale & (3) resize to image_size:
                 face = img[y0:y1, x0:x1]
                 face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
-                face = cv2.resize(face, self.model.image_size, interpolation=cv2.INTER_CUBIC)
+                face = cv2.resize(face, model.image_size, interpolation=cv2.INTER_CUBIC)
 
                 # The prediction result
-                prediction = self.model.predict(face)
+                prediction = model.predict(face)
                 predicted_label = prediction[0]
                 classifier_output = prediction[1]
 
                 # Now let's get the distance from the assuming a 1-Nearest Neighbor.
                 # Since it's a 1-Nearest Neighbor only look take the zero-th element:
                 distance = float(classifier_output['distances'][0])
-                name = str(self.model.subject_names[predicted_label])
+                name = str(model.subject_names[predicted_label])
 
                 # Create a PersonWrapper
                 a_person = PersonWrapper(r, name, distance, image_size)
@@ -191,12 +199,12 @@ class Recognizer(object):
                 # Publish the result
                 self.publish_persons(persons, cause_uuid)
 
-            # Check if external restart requested
+            # Check if external restart requested, the current model is used until the new one is loaded
             try:
                 z = self.last_restart_request.get(False)
-                if z:
-                    self.restart = True
-                    self.doRun = False
+                if z and self.model_loader is not None:
+                    print ">> Received Restart Request, Loading Model <-- " + str(self.model_loader.model_filename)
+                    self.model_loader.request_reload()
             except Exception, e:
                 pass
 
@@ -218,6 +226,8 @@ if __name__ == '__main__':
                       help="Resizes the given dataset to a given size in format [width]x[height] (default: 70x70).")
     parser.add_option("-v", "--validate", action="store", dest="numfolds", type="int", default=None,
                       help="Performs a k-fold cross validation on the dataset, if given (default: None).")
+    parser.add_option("-j", "--processes", action="store", dest="num_processes", type="int", default=1,
+                      help="Number of processes validating the folds in parallel (default: 1).")
     parser.add_option("-t", "--train", action="store", dest="dataset", type="string", default=None,
                       help="Trains the model on the given dataset.")
     parser.add_option("-c", "--cascade", action="store", dest="cascade_filename",
@@ -260,7 +270,8 @@ if __name__ == '__main__':
         sys.exit(1)
 
     if options.dataset:
-        trainer = TheTrainer(options.dataset, image_size, model_filename, _numfolds=options.numfolds)
+        trainer = TheTrainer(options.dataset, image_size, model_filename, _numfolds=options.numfolds,
+                             _num_processes=options.num_processes)
         trainer.train()
 
     print ">> Loading model <-- " + str(model_filename)
@@ -274,13 +285,5 @@ if __name__ == '__main__':
     print ">> Restart Recognizer Scope <-- " + str(options.restart_notification)
     x = Recognizer(model=model, camera_id=None, cascade_filename=options.cascade_filename, run_local=False,
                    inscope=options.rsb_source, outscope=str(options.rsb_destination), wait=options.wait_time,
-                   notification=options.restart_notification, show_gui=options.show_gui)
+                   notification=options.restart_notification, show_gui=options.show_gui, model_filename=model_filename)
     x.run_distributed()
-    while x.restart:
-        time.sleep(1)
-        model = load_model(model_filename)
-        print ">> Known Persons --> ", ", ".join(model.subject_names.values())
-        x = Recognizer(model=model, camera_id=None, cascade_filename=options.cascade_filename, run_local=False,
-                       inscope=options.rsb_source, outscope=str(options.rsb_destination), wait=options.wait_time,
-                       notification=options.restart_notification, show_gui=options.show_gui)
-        x.run_distributed()
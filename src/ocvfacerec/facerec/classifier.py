@@ -33,10 +33,12 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 from ocvfacerec.facerec.distance import EuclideanDistance
-from ocvfacerec.facerec.util import as_row_matrix
+from ocvfacerec.facerec.kernel import get_kernel
+from ocvfacerec.facerec.util import as_rows
 import logging
 import numpy as np
 import operator as op
+import ctypes
 
 
 class AbstractClassifier(object):
@@ -49,29 +51,155 @@ class AbstractClassifier(object):
     def update(self, X, y):
         raise NotImplementedError("This Classifier is cannot be updated.")
 
+    def remove(self, label):
+        raise NotImplementedError("This Classifier cannot remove classes.")
+
+    def compact(self, gallery_dtype=np.float32):
+        """
+        Prepares the classifier for prediction only. Classifiers, which store samples,
+        convert them to gallery_dtype.
+        """
+        pass
+
 
 class NearestNeighbor(AbstractClassifier):
     """
     Implements a k-Nearest Neighbor Model with a generic distance metric.
+
+    The samples are stored as rows of one gallery array, which grows by doubling its
+    capacity, so updates take amortized constant time. The squared norms of the
+    samples are cached alongside, so Euclidean distances to all samples are computed
+    with a single matrix product.
     """
 
     def __init__(self, dist_metric=EuclideanDistance(), k=1):
         AbstractClassifier.__init__(self)
         self.k = k
         self.dist_metric = dist_metric
-        self.X = []
-        self.y = np.array([], dtype=np.int32)
+        self._set_gallery(np.empty((0, 0)), np.array([], dtype=np.int32), None)
+
+    def _set_gallery(self, gallery, labels, sample_shape, norms=None):
+        self._gallery = gallery
+        self._labels = labels
+        self._size = gallery.shape[0]
+        self.sample_shape = sample_shape
+        if norms is None:
+            norms = self._row_norms(gallery)
+        self._norms = norms
+
+    @staticmethod
+    def _row_norms(gallery):
+        gallery = np.asarray(gallery, dtype=np.float)
+        return np.sum(gallery * gallery, axis=1)
+
+    def _reserve(self, size, dim, dtype):
+        # grows the buffers to hold size samples, doubling the capacity
+        capacity = self._gallery.shape[0]
+        if size <= capacity and self._gallery.flags.writeable:
+            return
+        capacity = max(size, 2 * capacity, 16)
+        gallery = np.empty((capacity, dim), dtype=dtype)
+        labels = np.empty(capacity, dtype=np.int32)
+        norms = np.empty(capacity)
+        gallery[0:self._size] = self._gallery[0:self._size]
+        labels[0:self._size] = self._labels[0:self._size]
+        norms[0:self._size] = self._norms[0:self._size]
+        self._gallery, self._labels, self._norms = gallery, labels, norms
+
+    @property
+    def gallery(self):
+        """
+        The samples as rows of a [num_data x dim] array.
+        """
+        return self._gallery[0:self._size]
+
+    @property
+    def norms(self):
+        """
+        The squared euclidean norms of the samples.
+        """
+        return self._norms[0:self._size]
+
+    @property
+    def X(self):
+        """
+        The samples as a list of arrays of their original shape (views of the gallery).
+        """
+        return [x.reshape(self.sample_shape) for x in self.gallery]
+
+    @property
+    def y(self):
+        return self._labels[0:self._size]
 
     def update(self, X, y):
         """
-        Updates the classifier.
+        Updates the classifier with a sample X of class y, or with a list of samples X
+        of the classes in y.
+        """
+        if np.ndim(y) == 0:
+            X, y = [X], [y]
+        if len(y) == 0:
+            return
+        if self.sample_shape is None:
+            self.sample_shape = np.shape(X[0])
+        rows = as_rows(X)
+        if self._size == 0:
+            dtype = rows.dtype
+        else:
+            dtype = self._gallery.dtype
+        start, end = self._size, self._size + rows.shape[0]
+        self._reserve(end, rows.shape[1], dtype)
+        self._gallery[start:end] = rows
+        self._labels[start:end] = y
+        self._norms[start:end] = self._row_norms(self._gallery[start:end])
+        self._size = end
+
+    def remove(self, label):
+        """
+        Removes all samples of a class without retraining. The labels are positional
+        (as in a NumericDataSet), so all labels above the removed one are decremented.
+        The removed samples are overwritten with zeros.
+
+        Returns:
+
+            The number of removed samples.
         """
-        self.X.append(X)
-        self.y = np.append(self.y, y)
+        keep = self.y != label
+        num_keep = int(np.sum(keep))
+        num_removed = self._size - num_keep
+        if num_removed == 0:
+            return 0
+        labels = self.y[keep]
+        labels[labels > label] -= 1
+        if self._gallery.flags.writeable and self._labels.flags.writeable and self._norms.flags.writeable:
+            # compact the gallery in place (fancy indexing copies the kept rows first)
+            self._gallery[0:num_keep] = self.gallery[keep]
+            self._norms[0:num_keep] = self.norms[keep]
+            self._labels[0:num_keep] = labels
+            self._gallery[num_keep:self._size] = 0
+            self._norms[num_keep:self._size] = 0
+            self._size = num_keep
+        else:
+            # a memory-mapped gallery is read-only, the file itself has to be saved again
+            self._set_gallery(np.ascontiguousarray(self.gallery[keep]), labels, self.sample_shape,
+                              np.ascontiguousarray(self.norms[keep]))
+        return num_removed
 
     def compute(self, X, y):
-        self.X = X
-        self.y = np.asarray(y)
+        if len(y) == 0:
+            self._set_gallery(np.empty((0, 0)), np.array([], dtype=np.int32), None)
+            return
+        self._set_gallery(as_rows(X), np.asarray(y, dtype=np.int32), np.shape(X[0]))
+
+    def distances(self, q):
+        """
+        Returns the distances of the query q to all samples.
+        """
+        q = np.asarray(q, dtype=np.float).reshape(1, -1)
+        if isinstance(self.dist_metric, EuclideanDistance):
+            D = self.norms + np.dot(q, q.T)[0, 0] - 2 * np.dot(self.gallery, q[0])
+            return np.sqrt(np.maximum(D, 0))
+        return self.dist_metric.pairwise(q, self.gallery)[0]
 
     def predict(self, q):
         """
@@ -101,11 +229,7 @@ class NearestNeighbor(AbstractClassifier):
             output.    
                     
         """
-        distances = []
-        for xi in self.X:
-            xi = xi.reshape(-1, 1)
-            d = self.dist_metric(xi, q)
-            distances.append(d)
+        distances = self.distances(q)
         if len(distances) > len(self.y):
             raise Exception("More distances than classes. Is your distance metric correct?")
         distances = np.asarray(distances)
@@ -128,6 +252,39 @@ class NearestNeighbor(AbstractClassifier):
         # item 
         return [predicted_label, {'labels': sorted_y, 'distances': sorted_distances}]
 
+    def compact(self, gallery_dtype=np.float32):
+        """
+        Trims the gallery to its samples and stores them as gallery_dtype. np.float16
+        halves the size again, at the cost of precision in the distances.
+        """
+        gallery = np.ascontiguousarray(self.gallery, dtype=gallery_dtype)
+        self._set_gallery(gallery, np.ascontiguousarray(self.y, dtype=np.int32), self.sample_shape)
+
+    def __getstate__(self):
+        # store only the samples (no spare capacity) as one [num_data x dim] array,
+        # so serialization writes (and memory-maps) the gallery as a single block
+        state = dict((key, value) for key, value in self.__dict__.iteritems()
+                     if key not in ('_gallery', '_labels', '_norms', '_size'))
+        state['X'] = self.gallery
+        state['y'] = self.y
+        state['norms'] = self.norms
+        return state
+
+    def __setstate__(self, state):
+        X = state.pop('X')
+        y = state.pop('y')
+        norms = state.pop('norms', None)
+        sample_shape = state.pop('sample_shape', None)
+        self.__dict__.update(state)
+        if isinstance(X, list):
+            # pickled before the gallery was stacked into one array
+            if len(X) == 0:
+                X = np.empty((0, 0))
+            else:
+                sample_shape = np.shape(X[0])
+                X = as_rows(X)
+        self._set_gallery(X, np.asarray(y), sample_shape, norms)
+
     def __repr__(self):
         return "NearestNeighbor (k=%s, dist_metric=%s)" % (self.k, repr(self.dist_metric))
 
@@ -141,10 +298,69 @@ except:
     logger = logging.getLogger("facerec.classifier.SVM")
     logger.debug("Import Error: libsvm bindings not available.")
 
-import sys
-from StringIO import StringIO
+# Memory layout of the libsvm struct svm_node {int index; double value;}
+svm_node_dtype = np.dtype([('index', np.intc), ('value', np.double)], align=True)
+
+# The plain fields of a svm_parameter. It is a ctypes structure with pointers, which
+# can neither be copied by the copy module nor pickled.
+svm_parameter_fields = ['svm_type', 'kernel_type', 'degree', 'gamma', 'coef0', 'cache_size', 'eps', 'C', 'nu', 'p',
+                        'shrinking', 'probability']
+
+
+def copy_svm_parameter(param):
+    """
+    Returns a new svm_parameter with the fields and class weights of param.
+    """
+    copy = svm_parameter("-q")
+    for name in svm_parameter_fields:
+        setattr(copy, name, getattr(param, name))
+    n = param.nr_weight
+    if n > 0:
+        copy.nr_weight = n
+        copy.weight_label = (ctypes.c_int * n)(*param.weight_label[:n])
+        copy.weight = (ctypes.c_double * n)(*param.weight[:n])
+    return copy
 
-bkp_stdout = sys.stdout
+
+def svm_nodes(X, first_index=1):
+    """
+    Writes the rows of a [num_data x dim] array as dense libsvm node arrays into a
+    single contiguous buffer, each row terminated by the index -1.
+
+    Returns:
+
+        (nodes, rows) with the buffer, which must be kept alive as long as libsvm uses
+        it, and a list of svm_node pointers to its rows.
+    """
+    X = np.asarray(X, dtype=np.double)
+    n, d = X.shape
+    nodes = np.empty((n, d + 1), dtype=svm_node_dtype)
+    nodes['index'][:, 0:d] = np.arange(first_index, first_index + d)
+    nodes['value'][:, 0:d] = X
+    nodes['index'][:, d] = -1
+    nodes['value'][:, d] = 0
+    node_pointer = ctypes.POINTER(svm_node)
+    address, stride = nodes.ctypes.data, nodes.strides[0]
+    rows = [ctypes.cast(address + i * stride, node_pointer) for i in range(n)]
+    return nodes, rows
+
+
+def dense_svm_problem(X, y, first_index=1):
+    """
+    Creates a libsvm problem directly from a [num_data x dim] array, without going
+    through Python lists. Pass first_index=0 for precomputed kernel rows, which start
+    with the serial number of the sample.
+    """
+    nodes, rows = svm_nodes(X, first_index)
+    y = np.ascontiguousarray(y, dtype=np.double)
+    problem = svm_problem.__new__(svm_problem)
+    problem.l = len(rows)
+    problem.n = first_index + nodes.shape[1] - 2
+    problem.y = y.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+    problem.x = (ctypes.POINTER(svm_node) * len(rows))(*rows)
+    problem.x_space = rows
+    problem.buffers = (nodes, y)
+    return problem
 
 
 class SVM(AbstractClassifier):
@@ -163,9 +379,19 @@ class SVM(AbstractClassifier):
     Please keep in mind to normalize your input data, as expected
     for the model. There's no way to assume a generic normalization
     step.
+
+    Predictions call libsvm's svm_predict_values directly on node arrays
+    built from numpy arrays, so nothing is printed and sys.stdout is left
+    alone (which makes predicting from several threads safe).
+
+    Besides the libsvm kernels, kernel='chi2' or kernel='intersection' (see
+    facerec.kernel) trains on a precomputed chi-square or histogram intersection
+    kernel, which suits histogram features like the SpatialHistogram. These
+    kernels have no gamma, so only C needs to be tuned. At predict time the
+    kernel is computed against the support vectors only.
     """
 
-    def __init__(self, param=None):
+    def __init__(self, param=None, kernel=None):
         AbstractClassifier.__init__(self)
         self.logger = logging.getLogger("facerec.classifier.SVM")
         self.param = param
@@ -173,17 +399,120 @@ class SVM(AbstractClassifier):
         self.param = param
         if self.param is None:
             self.param = svm_parameter("-q")
+        self.kernel = kernel
+        if self.kernel is not None:
+            self.kernel_function = get_kernel(kernel)
+            # the caller's parameter may be shared with other models, so change a copy
+            self.param = copy_svm_parameter(self.param)
+            self.param.kernel_type = PRECOMPUTED
 
     def compute(self, X, y):
+        if self.kernel is not None:
+            self._compute_precomputed(as_rows(X).astype(np.double), y)
+            return
         self.logger.debug("SVM TRAINING (C=%.2f,gamma=%.2f,p=%.2f,nu=%.2f,coef=%.2f,degree=%.2f)" % (
             self.param.C, self.param.gamma, self.param.p, self.param.nu, self.param.coef0, self.param.degree))
-        # turn data into a row vector (needed for libsvm)
-        X = as_row_matrix(X)
         y = np.asarray(y)
-        problem = svm_problem(y, X.tolist())
-        self.svm = svm_train(problem, self.param)
+        self._train(dense_svm_problem(as_rows(X), y))
+        self.y = y
+
+    def compute_kernel(self, K, y):
+        """
+        Trains the SVM on a precomputed kernel matrix (libsvm kernel_type PRECOMPUTED).
+
+        Args:
+
+            K: The [num_data x num_data] kernel matrix of the training samples.
+            y: The classes of the training samples.
+        """
+        self.param.kernel_type = PRECOMPUTED
+        self.logger.debug("SVM TRAINING (C=%.2f, precomputed kernel)" % (self.param.C))
+        y = np.asarray(y)
+        self._train(dense_svm_problem(self._kernel_rows(K), y, first_index=0))
         self.y = y
 
+    def _compute_precomputed(self, X, y):
+        self.compute_kernel(self.kernel_function(X, X), y)
+        # only the support vectors contribute to a decision, so only they are kept
+        # (libsvm before 3.18 doesn't report them, then all samples are kept)
+        if hasattr(self.svm, "get_sv_indices"):
+            self.sv_columns = np.asarray(self.svm.get_sv_indices(), dtype=np.int) - 1
+        else:
+            self.sv_columns = np.arange(X.shape[0])
+        self.sv_features = X[self.sv_columns]
+        self.num_train = X.shape[0]
+
+    def compact(self, gallery_dtype=np.float32):
+        # libsvm keeps its own copy of the support vectors, only the kernel support
+        # vectors are stored in the classifier
+        if self.kernel is not None and hasattr(self, "sv_features"):
+            self.sv_features = np.ascontiguousarray(self.sv_features, dtype=gallery_dtype)
+
+    def _query_kernel(self, X):
+        # kernel values of the queries to all training samples, with zeros for the
+        # samples, which aren't support vectors and are never read by libsvm
+        K = np.zeros((X.shape[0], self.num_train))
+        K[:, self.sv_columns] = self.kernel_function(X, self.sv_features)
+        return K
+
+    def _train(self, problem):
+        self.svm = svm_train(problem, self.param)
+        # libsvm's support vectors point into the node buffer of the problem
+        self.svm.buffers = problem.buffers
+
+    def predict_kernel(self, k):
+        """
+        Predicts a query given by its kernel values to all training samples. Returns
+        the same output as predict.
+        """
+        return self.predict_kernel_batch(np.asarray(k).reshape(1, -1))[0]
+
+    def predict_kernel_batch(self, K):
+        """
+        Predicts all queries given by the rows of a [num_queries x num_data] kernel matrix.
+        """
+        nodes, rows = svm_nodes(self._kernel_rows(K), first_index=0)
+        return self._predict_rows(rows)
+
+    def _kernel_rows(self, K):
+        # libsvm expects the serial number of a sample as the first value of a
+        # precomputed kernel row, the serial number of a query is ignored
+        K = np.asarray(K, dtype=np.double)
+        return np.hstack((np.arange(1, K.shape[0] + 1, dtype=np.double).reshape(-1, 1), K))
+
+    def predict_batch(self, X):
+        """
+        Predicts many samples at once.
+
+        Args:
+
+            X: The query samples as a list or an array with one sample per row.
+
+        Returns:
+
+            A list with the output of predict for every sample.
+        """
+        if self.kernel is not None:
+            return self.predict_kernel_batch(self._query_kernel(as_rows(X).astype(np.double)))
+        nodes, rows = svm_nodes(as_rows(X))
+        return self._predict_rows(rows)
+
+    def _predict_rows(self, rows):
+        if self.svm.get_svm_type() in (ONE_CLASS, EPSILON_SVR, NU_SVR):
+            num_values = 1
+        else:
+            num_classes = self.svm.get_nr_class()
+            num_values = num_classes * (num_classes - 1) // 2
+        dec_values = (ctypes.c_double * num_values)()
+        results = []
+        for row in rows:
+            label = libsvm.svm_predict_values(self.svm, row, dec_values)
+            p_lbl = [label]
+            p_acc = evaluations([0], p_lbl)
+            p_val = [dec_values[0:num_values]]
+            results.append([int(label), {'p_lbl': p_lbl, 'p_acc': p_acc, 'p_val': p_val}])
+        return results
+
     def predict(self, X):
         """
         
@@ -209,14 +538,11 @@ class SVM(AbstractClassifier):
                     Note that the order of classes here is the same as 'model.label'
                     field in the model structure.
         """
-        X = np.asarray(X).reshape(1, -1)
-        sys.stdout = StringIO()
-        p_lbl, p_acc, p_val = svm_predict([0], X.tolist(), self.svm)
-        sys.stdout = bkp_stdout
-        predicted_label = int(p_lbl[0])
-        return [predicted_label, {'p_lbl': p_lbl, 'p_acc': p_acc, 'p_val': p_val}]
+        return self.predict_batch(np.asarray(X).reshape(1, -1))[0]
 
     def __repr__(self):
+        if self.kernel is not None:
+            return "Support Vector Machine (kernel=%s, C=%.2f)" % (self.kernel, self.param.C)
         return "Support Vector Machine (kernel_type=%s, C=%.2f,gamma=%.2f,p=%.2f,nu=%.2f,coef=%.2f,degree=%.2f)" % (
             KERNEL_TYPE[self.param.kernel_type], self.param.C, self.param.gamma, self.param.p, self.param.nu,
             self.param.coef0, self.param.degree)
@@ -32,50 +32,139 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import numpy as np
 
 # To abstract the dirty things away, we are going to use a 
 # new class, which we call a NumericDataSet. This NumericDataSet
 # allows us to add images and turn them into a facerec compatible
 # representation.
 #
-# This DataSet does not provide a method for removing entities yet,
-# because this would render the ordering of the labels useless. 
-# This is caused by a severe limitation of the framework right now,
-# because it would make algorithms like LDA and PCA fail.
+# The images are stored in one preallocated [N x height x width] uint8
+# array, which doubles its capacity when full. Every sample has a label
+# and an identity index. The identity index of a person never changes,
+# while the labels are kept positional (0..c-1), because algorithms like
+# LDA and PCA rely on that. Removing a person marks its samples as
+# removed (tombstones) and moves the labels above it down by one, the
+# samples are physically removed by compact().
 
 class NumericDataSet(object):
-    def __init__(self):
-        self.data = {}
+    def __init__(self, capacity=64):
         self.str_to_num_mapping = {}
         self.num_to_str_mapping = {}
+        # identity index of every name ever added, never reused
+        self.identities = {}
+        self._capacity = capacity
+        self._images = None
+        self._labels = np.empty(0, dtype=np.int32)
+        self._identities = np.empty(0, dtype=np.int32)
+        self._removed = np.empty(0, dtype=np.bool)
+        self._size = 0
+        self._num_removed = 0
+
+    def _reserve(self, size, shape):
+        if self._images is not None and size <= self._images.shape[0]:
+            return
+        capacity = max(size, self._capacity)
+        if self._images is not None:
+            capacity = max(capacity, 2 * self._images.shape[0])
+        images = np.empty((capacity,) + shape, dtype=np.uint8)
+        labels = np.empty(capacity, dtype=np.int32)
+        identities = np.empty(capacity, dtype=np.int32)
+        removed = np.zeros(capacity, dtype=np.bool)
+        if self._images is not None:
+            images[0:self._size] = self._images[0:self._size]
+        labels[0:self._size] = self._labels[0:self._size]
+        identities[0:self._size] = self._identities[0:self._size]
+        removed[0:self._size] = self._removed[0:self._size]
+        self._images, self._labels, self._identities, self._removed = images, labels, identities, removed
 
     def add(self, identifier, image):
-        try:
-            self.data[identifier].append(image)
-        except:
-            self.data[identifier] = [image]
+        image = np.asarray(image, dtype=np.uint8)
+        if self._images is not None and image.shape != self._images.shape[1:]:
+            raise ValueError("Expected an image of shape %s, got %s." % (str(self._images.shape[1:]), str(image.shape)))
+        if identifier not in self.str_to_num_mapping:
             numerical_identifier = len(self.str_to_num_mapping)
             # Store in mapping tables:
             self.str_to_num_mapping[identifier] = numerical_identifier
             self.num_to_str_mapping[numerical_identifier] = identifier
+            if identifier not in self.identities:
+                self.identities[identifier] = len(self.identities)
+        self._reserve(self._size + 1, image.shape)
+        i = self._size
+        self._images[i] = image
+        self._labels[i] = self.str_to_num_mapping[identifier]
+        self._identities[i] = self.identities[identifier]
+        self._removed[i] = False
+        self._size = i + 1
+
+    def remove(self, identifier):
+        """
+        Removes all images of a person. The labels above the person's label move
+        down by one, the images are only marked as removed until compact() is called.
+
+        Returns:
+            The number of removed images.
+        """
+        label = self.str_to_num_mapping.pop(identifier)
+        samples = self._removed[0:self._size] == False
+        samples &= self._labels[0:self._size] == label
+        num_removed = int(np.sum(samples))
+        self._removed[0:self._size] |= samples
+        self._num_removed = self._num_removed + num_removed
+        labels = self._labels[0:self._size]
+        labels[labels > label] -= 1
+        for name, num in self.str_to_num_mapping.items():
+            if num > label:
+                self.str_to_num_mapping[name] = num - 1
+        self.num_to_str_mapping = dict((num, name) for name, num in self.str_to_num_mapping.iteritems())
+        return num_removed
+
+    def compact(self):
+        """
+        Moves the remaining images together and clears the removed ones. Views
+        returned by get() before are invalid afterwards.
+        """
+        if self._num_removed == 0:
+            return
+        keep = self._removed[0:self._size] == False
+        size = int(np.sum(keep))
+        # fancy indexing copies the kept rows first
+        self._images[0:size] = self._images[0:self._size][keep]
+        self._labels[0:size] = self._labels[0:self._size][keep]
+        self._identities[0:size] = self._identities[0:self._size][keep]
+        self._images[size:self._size] = 0
+        self._removed[0:self._size] = False
+        self._size = size
+        self._num_removed = 0
 
     def get(self):
-        X = []
-        y = []
-        for name, num in self.str_to_num_mapping.iteritems():
-            for image in self.data[name]:
-                X.append(image)
-                y.append(num)
-        return X, y
+        """
+        Returns the images as a [num_images x height x width] array and their labels,
+        both are views of the dataset (compacted first, if images were removed).
+        """
+        self.compact()
+        if self._images is None:
+            return np.empty((0, 0, 0), dtype=np.uint8), self._labels[0:0]
+        return self._images[0:self._size], self._labels[0:self._size]
+
+    def get_identities(self):
+        """
+        Returns the identity index of every image returned by get().
+        """
+        self.compact()
+        return self._identities[0:self._size]
 
     def resolve_by_str(self, identifier):
-        return self.str_num_mapping[identifier]
+        return self.str_to_num_mapping[identifier]
 
     def resolve_by_num(self, numerical_identifier):
         return self.num_to_str_mapping[numerical_identifier]
 
     def length(self):
-        return len(self.data)
+        return len(self.str_to_num_mapping)
+
+    def num_images(self):
+        return self._size - self._num_removed
 
     def __repr__(self):
-        print "NumericDataSet"
+        return "NumericDataSet (persons=%d, images=%d)" % (self.length(), self.num_images())
@@ -35,6 +35,20 @@
 import numpy as np
 
 
+def blockwise(P, Q, fn, max_elements=2 ** 22):
+    """
+    Evaluates fn(P[block][:, np.newaxis, :], Q[np.newaxis, :, :]) over blocks of rows of P,
+    so the broadcasted [rows x n x d] temporaries stay below max_elements.
+    """
+    P = np.asarray(P, dtype=np.float)
+    Q = np.asarray(Q, dtype=np.float)
+    D = np.empty((P.shape[0], Q.shape[0]))
+    rows = max(1, max_elements // max(1, Q.shape[0] * Q.shape[1]))
+    for i in range(0, P.shape[0], rows):
+        D[i:i + rows] = fn(P[i:i + rows, np.newaxis, :], Q[np.newaxis, :, :])
+    return D
+
+
 class AbstractDistance(object):
     def __init__(self, name):
         self._name = name
@@ -42,6 +56,22 @@ class AbstractDistance(object):
     def __call__(self, p, q):
         raise NotImplementedError("Every AbstractDistance must implement the __call__ method.")
 
+    def pairwise(self, P, Q):
+        """
+        Computes the distances between all rows of P [m x d] and all rows of Q [n x d].
+        Distances, which can be vectorized, override this method.
+
+        Returns:
+            The [m x n] distance matrix.
+        """
+        P = np.asarray(P)
+        Q = np.asarray(Q)
+        D = np.empty((P.shape[0], Q.shape[0]))
+        for i in range(0, P.shape[0]):
+            for j in range(0, Q.shape[0]):
+                D[i, j] = self(P[i], Q[j])
+        return D
+
     @property
     def name(self):
         return self._name
@@ -59,6 +89,18 @@ class EuclideanDistance(AbstractDistance):
         q = np.asarray(q).flatten()
         return np.sqrt(np.sum(np.power((p - q), 2)))
 
+    def pairwise(self, P, Q):
+        return np.sqrt(self.squared_pairwise(P, Q))
+
+    def squared_pairwise(self, P, Q):
+        """
+        Computes the squared distances between all rows of P [m x d] and all rows of Q [n x d].
+        """
+        P = np.asarray(P, dtype=np.float)
+        Q = np.asarray(Q, dtype=np.float)
+        D = np.sum(P * P, axis=1).reshape(-1, 1) + np.sum(Q * Q, axis=1).reshape(1, -1) - 2 * np.dot(P, Q.T)
+        return np.maximum(D, 0)
+
 
 class CosineDistance(AbstractDistance):
     """
@@ -76,6 +118,12 @@ class CosineDistance(AbstractDistance):
         q = np.asarray(q).flatten()
         return -np.dot(p.T, q) / (np.sqrt(np.dot(p, p.T) * np.dot(q, q.T)))
 
+    def pairwise(self, P, Q):
+        P = np.asarray(P, dtype=np.float)
+        Q = np.asarray(Q, dtype=np.float)
+        norms = np.sqrt(np.sum(P * P, axis=1)).reshape(-1, 1) * np.sqrt(np.sum(Q * Q, axis=1)).reshape(1, -1)
+        return -np.dot(P, Q.T) / norms
+
 
 class NormalizedCorrelation(AbstractDistance):
     """
@@ -115,6 +163,9 @@ class ChiSquareDistance(AbstractDistance):
         bin_dists = (p - q) ** 2 / (p + q + np.finfo('float').eps)
         return np.sum(bin_dists)
 
+    def pairwise(self, P, Q):
+        return blockwise(P, Q, lambda p, q: np.sum((p - q) ** 2 / (p + q + np.finfo('float').eps), axis=2))
+
 
 class HistogramIntersection(AbstractDistance):
     def __init__(self):
@@ -125,6 +176,9 @@ class HistogramIntersection(AbstractDistance):
         q = np.asarray(q).flatten()
         return np.sum(np.minimum(p, q))
 
+    def pairwise(self, P, Q):
+        return blockwise(P, Q, lambda p, q: np.sum(np.minimum(p, q), axis=2))
+
 
 class BinRatioDistance(AbstractDistance):
     """
@@ -36,18 +36,53 @@ import numpy as np
 
 
 class AbstractFeature(object):
+    # A fusable feature transforms a float image of the same shape in place, see
+    # extract_inplace. A ChainOperator runs consecutive fusable stages on a single
+    # buffer, which is converted where a stage works in another fused_dtype (None
+    # keeps a float input's dtype, see inplace_dtype).
+    fusable = False
+    fused_dtype = np.float
+    # A stateless feature does not learn anything in compute, so its output for a
+    # sample does not depend on the other samples and can be cached across folds.
+    stateless = False
+    # Attributes, which are only needed for training or inspecting a feature and not
+    # to extract features, compact drops them.
+    training_state = ()
+
     def compute(self, X, y):
         raise NotImplementedError("Every AbstractFeature must implement the compute method.")
 
     def extract(self, X):
         raise NotImplementedError("Every AbstractFeature must implement the extract method.")
 
+    def extract_inplace(self, X):
+        raise NotImplementedError("Only a fusable AbstractFeature implements the extract_inplace method.")
+
+    def inplace_dtype(self, dtype):
+        """
+        Returns the dtype extract works in for an input of the given dtype.
+        """
+        if self.fused_dtype is None:
+            return dtype if np.dtype(dtype).kind == 'f' else np.dtype(np.float)
+        return np.dtype(self.fused_dtype)
+
     def save(self):
         raise NotImplementedError("Not implemented yet (TODO).")
 
     def load(self):
         raise NotImplementedError("Not implemented yet (TODO).")
 
+    def compact(self):
+        """
+        Prepares the feature for extraction only: drops the training state and stores
+        the float arrays as contiguous float32 arrays.
+        """
+        for name in self.training_state:
+            self.__dict__.pop(name, None)
+        for name, value in self.__dict__.items():
+            if isinstance(value, np.ndarray) and value.dtype.kind == 'f':
+                self.__dict__[name] = np.ascontiguousarray(value, dtype=np.float32)
+
     def __repr__(self):
         return "AbstractFeature"
 
@@ -57,6 +92,7 @@ class Identity(AbstractFeature):
     Simplest AbstractFeature you could imagine. It only forwards the data and does not operate on it, 
     probably useful for learning a Support Vector Machine on raw data for example!
     """
+    stateless = True
 
     def __init__(self):
         AbstractFeature.__init__(self)
@@ -76,6 +112,8 @@ from ocvfacerec.facerec.operators import ChainOperator, CombineOperator
 
 
 class PCA(AbstractFeature):
+    training_state = ('_eigenvalues',)
+
     def __init__(self, num_components=0):
         AbstractFeature.__init__(self)
         self._num_components = num_components
@@ -140,6 +178,8 @@ class PCA(AbstractFeature):
 
 
 class LDA(AbstractFeature):
+    training_state = ('_eigenvalues',)
+
     def __init__(self, num_components=0):
         AbstractFeature.__init__(self)
         self._num_components = num_components
@@ -204,6 +244,8 @@ class LDA(AbstractFeature):
 
 
 class Fisherfaces(AbstractFeature):
+    training_state = ('_eigenvalues',)
+
     def __init__(self, num_components=0):
         AbstractFeature.__init__(self)
         self._num_components = num_components
@@ -264,6 +306,8 @@ from ocvfacerec.facerec.lbp import LocalDescriptor, ExtendedLBP
 
 
 class SpatialHistogram(AbstractFeature):
+    stateless = True
+
     def __init__(self, lbp_operator=ExtendedLBP(), sz=(8, 8)):
         AbstractFeature.__init__(self)
         if not isinstance(lbp_operator, LocalDescriptor):
@@ -0,0 +1,78 @@
+# Copyright (c) 2015.
+# Philipp Wagner <bytefish[at]gmx[dot]de> and
+# Florian Lier <flier[at]techfak.uni-bielefeld.de> and
+# Norman Koester <nkoester[at]techfak.uni-bielefeld.de>
+#
+#
+# Released to public domain under terms of the BSD Simplified license.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the organization nor the names of its contributors
+#     may be used to endorse or promote products derived from this software
+#     without specific prior written permission.
+#
+#    See <http://www.opensource.org/licenses/bsd-license>
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from ocvfacerec.facerec.distance import blockwise
+import numpy as np
+
+
+def chi_square_kernel(P, Q, max_elements=2 ** 22):
+    """
+    Computes the additive chi-square kernel sum(2 * p * q / (p + q)) between all rows
+    of P [m x d] and all rows of Q [n x d]. Both are expected to be histograms, as
+    computed by the SpatialHistogram feature.
+
+    Returns:
+        The [m x n] kernel matrix.
+    """
+    return blockwise(P, Q, lambda p, q: np.sum(2 * p * q / (p + q + np.finfo('float').eps), axis=2),
+                     max_elements)
+
+
+def histogram_intersection_kernel(P, Q, max_elements=2 ** 22):
+    """
+    Computes the histogram intersection kernel sum(min(p, q)) between all rows of
+    P [m x d] and all rows of Q [n x d].
+
+    Returns:
+        The [m x n] kernel matrix.
+    """
+    return blockwise(P, Q, lambda p, q: np.sum(np.minimum(p, q), axis=2), max_elements)
+
+
+# Kernels by the name the SVM classifier accepts.
+KERNELS = {
+    'chi2': chi_square_kernel,
+    'intersection': histogram_intersection_kernel
+}
+
+
+def get_kernel(kernel):
+    """
+    Returns the kernel function for a name in KERNELS, callables are returned as they are.
+    """
+    if callable(kernel):
+        return kernel
+    if kernel not in KERNELS:
+        raise ValueError("Unknown kernel '%s', expected one of %s." % (kernel, ", ".join(sorted(KERNELS))))
+    return KERNELS[kernel]
@@ -34,6 +34,9 @@
 
 from ocvfacerec.facerec.feature import AbstractFeature
 from ocvfacerec.facerec.classifier import AbstractClassifier
+from ocvfacerec.facerec.util import array_nbytes
+import logging
+import numpy as np
 
 
 class PredictableModel(object):
@@ -54,6 +57,24 @@ class PredictableModel(object):
         q = self.feature.extract(X)
         return self.classifier.predict(q)
 
+    def compact(self, gallery_dtype=np.float32):
+        """
+        Shrinks a computed model for recognition only. The feature drops its training
+        state and stores its projection as contiguous float32, the classifier stores its
+        gallery as gallery_dtype (np.float16 halves it again). The model can't be
+        inspected or retrained afterwards.
+
+        Returns:
+
+            (bytes_before, bytes_after) the size of the model's arrays.
+        """
+        bytes_before = array_nbytes(self)
+        self.feature.compact()
+        self.classifier.compact(gallery_dtype)
+        bytes_after = array_nbytes(self)
+        logging.getLogger("facerec.model").info("Compacted model from %d to %d bytes." % (bytes_before, bytes_after))
+        return bytes_before, bytes_after
+
     def __repr__(self):
         feature_repr = repr(self.feature)
         classifier_repr = repr(self.classifier)
@@ -35,26 +35,86 @@
 import numpy as np
 
 
-def minmax(X, low, high, minX=None, maxX=None, dtype=np.float):
+def minmax(X, low, high, minX=None, maxX=None, dtype=np.float, copy=True):
     X = np.asarray(X)
     if minX is None:
         minX = np.min(X)
     if maxX is None:
         maxX = np.max(X)
+    if np.dtype(dtype).kind != 'f':
+        return np.asarray(minmax(X, low, high, minX, maxX), dtype=dtype)
+    # work on a single buffer, X is only modified if copy=False and it already has the dtype
+    X = np.array(X, dtype=dtype, copy=copy)
     # normalize to [0...1].    
-    X = X - float(minX)
-    X = X / float((maxX - minX))
+    X -= float(minX)
+    X /= float((maxX - minX))
     # scale to [low...high].
-    X = X * (high - low)
-    X = X + low
-    return np.asarray(X, dtype=dtype)
+    X *= (high - low)
+    X += low
+    return X
 
 
-def zscore(X, mean=None, std=None):
+def zscore(X, mean=None, std=None, copy=True):
     X = np.asarray(X)
     if mean is None:
         mean = X.mean()
     if std is None:
         std = X.std()
-    X = (X - mean) / std
+    if X.dtype.kind != 'f':
+        X = np.array(X, dtype=np.float)
+    elif copy:
+        X = X.copy()
+    X -= mean
+    X /= std
     return X
+
+
+def streaming_minmax(X):
+    """ Computes the global minimum and maximum over a sequence of arrays in a single pass.
+
+    Args:
+        X [iterable] arrays (a list or a generator)
+
+    Returns:
+        (minX, maxX)
+    """
+    minX, maxX = None, None
+    for xi in X:
+        xi = np.asarray(xi)
+        if xi.size == 0:
+            continue
+        xmin, xmax = xi.min(), xi.max()
+        if minX is None or xmin < minX:
+            minX = xmin
+        if maxX is None or xmax > maxX:
+            maxX = xmax
+    return minX, maxX
+
+
+def streaming_mean_std(X):
+    """ Computes the global mean and (population) standard deviation over a sequence
+        of arrays in a single pass. The statistics of each array are merged with
+        Welford's (Chan et al.) parallel update, so no data matrix is built.
+
+    Args:
+        X [iterable] arrays (a list or a generator)
+
+    Returns:
+        (mean, std)
+    """
+    n, mean, m2 = 0, 0.0, 0.0
+    for xi in X:
+        xi = np.asarray(xi, dtype=np.float)
+        nb = xi.size
+        if nb == 0:
+            continue
+        mean_b = xi.mean()
+        m2_b = np.sum(np.square(xi - mean_b))
+        delta = mean_b - mean
+        total = n + nb
+        mean += delta * nb / total
+        m2 += m2_b + delta * delta * n * nb / total
+        n = total
+    if n == 0:
+        return 0.0, 1.0
+    return mean, np.sqrt(m2 / n)
@@ -33,7 +33,83 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import numpy as np
-from ocvfacerec.facerec.feature import AbstractFeature
+from ocvfacerec.facerec.feature import AbstractFeature, Identity
+
+
+def flatten_chain(model):
+    """
+    Returns the stages of a (possibly nested) ChainOperator in the order they are applied.
+    Any other feature is a single stage.
+    """
+    if isinstance(model, ChainOperator):
+        return flatten_chain(model.model1) + flatten_chain(model.model2)
+    return [model]
+
+
+def build_chain(stages):
+    """
+    Turns a list of stages back into a feature, chaining them if necessary.
+    An empty list yields the Identity.
+    """
+    if len(stages) == 0:
+        return Identity()
+    model = stages[0]
+    for stage in stages[1:]:
+        model = ChainOperator(model, stage)
+    return model
+
+
+def _same_value(value1, value2):
+    """
+    Compares two configuration values deeply: arrays by their contents, dicts, lists and
+    tuples element-wise and other objects by their type and attributes.
+    """
+    if value1 is value2:
+        return True
+    if type(value1) != type(value2):
+        return False
+    if isinstance(value1, np.ndarray):
+        return value1.shape == value2.shape and value1.dtype == value2.dtype and np.array_equal(value1, value2)
+    if isinstance(value1, dict):
+        return set(value1.keys()) == set(value2.keys()) and all(
+            [_same_value(value1[key], value2[key]) for key in value1])
+    if isinstance(value1, (list, tuple)):
+        return len(value1) == len(value2) and all([_same_value(v1, v2) for v1, v2 in zip(value1, value2)])
+    if hasattr(value1, '__dict__'):
+        return _same_value(value1.__dict__, value2.__dict__)
+    try:
+        return bool(value1 == value2)
+    except Exception:
+        return False
+
+
+def same_stage(model1, model2):
+    """
+    Two stages are considered identical, if they are the same instance or of the same
+    type with the same configuration, i.e. equal attributes. This has to be checked
+    before the stages are computed, since the fitted state of the stage of model2 is
+    never computed once the stages are shared.
+    """
+    return model1 is model2 or (type(model1) == type(model2) and _same_value(model1.__dict__, model2.__dict__))
+
+
+def split_common_prefix(model1, model2):
+    """
+    Splits two features into the longest chain of identical leading stages and
+    the remaining stages of each feature.
+
+    Returns:
+        (prefix, suffix1, suffix2) or None if the features share no leading stage.
+        The prefix consists of the stage instances of model1.
+    """
+    stages1 = flatten_chain(model1)
+    stages2 = flatten_chain(model2)
+    n = 0
+    while n < min(len(stages1), len(stages2)) and same_stage(stages1[n], stages2[n]):
+        n = n + 1
+    if n == 0:
+        return None
+    return build_chain(stages1[:n]), build_chain(stages1[n:]), build_chain(stages2[n:])
 
 
 class FeatureOperator(AbstractFeature):
@@ -50,6 +126,45 @@ class FeatureOperator(AbstractFeature):
             raise Exception("A FeatureOperator only works on classes implementing an AbstractFeature!")
         self.model1 = model1
         self.model2 = model2
+        # the stages are compared while they hold nothing but their configuration
+        self._branches = split_common_prefix(model1, model2)
+
+    @property
+    def stateless(self):
+        return self.model1.stateless and self.model2.stateless
+
+    def compute_branches(self, X, y):
+        """
+        Computes both models on the same input. If both models start with identical
+        stages, these stages are computed only once and their output is shared.
+        """
+        branches = self._get_branches()
+        if branches is None:
+            return self.model1.compute(X, y), self.model2.compute(X, y)
+        prefix, suffix1, suffix2 = branches
+        X = prefix.compute(X, y)
+        return suffix1.compute(X, y), suffix2.compute(X, y)
+
+    def extract_branches(self, X):
+        """
+        Extracts both models from the same input, sharing identical leading stages.
+        """
+        branches = self._get_branches()
+        if branches is None:
+            return self.model1.extract(X), self.model2.extract(X)
+        prefix, suffix1, suffix2 = branches
+        X = prefix.extract(X)
+        return suffix1.extract(X), suffix2.extract(X)
+
+    def compact(self):
+        self.model1.compact()
+        self.model2.compact()
+
+    def _get_branches(self):
+        # Models pickled before the prefix sharing have no branches yet:
+        if not hasattr(self, "_branches"):
+            self._branches = split_common_prefix(self.model1, self.model2)
+        return self._branches
 
     def __repr__(self):
         return "FeatureOperator(" + repr(self.model1) + "," + repr(self.model2) + ")"
@@ -60,6 +175,9 @@ class ChainOperator(FeatureOperator):
     The ChainOperator chains two feature extraction modules:
         model2.compute(model1.compute(X,y),y)
     Where X can be generic input data.
+
+    On extraction consecutive fusable stages (see AbstractFeature.fusable) are
+    applied in place on one buffer instead of allocating a new image per stage.
     
     Args:
         model1 [AbstractFeature]
@@ -74,8 +192,26 @@ class ChainOperator(FeatureOperator):
         return self.model2.compute(X, y)
 
     def extract(self, X):
-        X = self.model1.extract(X)
-        return self.model2.extract(X)
+        stages = flatten_chain(self)
+        i = 0
+        while i < len(stages):
+            # find the run of consecutive fusable stages starting at i
+            j = i
+            while j < len(stages) and stages[j].fusable:
+                j = j + 1
+            if j - i > 1:
+                # one copy into a buffer, which all stages of the run transform in place. Each
+                # stage works in its own dtype like its extract does, so a stage of another
+                # dtype converts the buffer once.
+                X = np.asarray(X)
+                X = np.array(X, dtype=stages[i].inplace_dtype(X.dtype))
+                for stage in stages[i:j]:
+                    X = stage.extract_inplace(np.asarray(X, dtype=stage.inplace_dtype(X.dtype)))
+                i = j
+            else:
+                X = stages[i].extract(X)
+                i = i + 1
+        return X
 
     def __repr__(self):
         return "ChainOperator(" + repr(self.model1) + "," + repr(self.model2) + ")"
@@ -86,6 +222,9 @@ class CombineOperator(FeatureOperator):
     The CombineOperator combines the output of two feature extraction modules as:
       (model1.compute(X,y),model2.compute(X,y))
     , where    the output of each feature is a [1xN] or [Nx1] feature vector.
+
+    Leading stages with the same configuration in both models are computed only
+    once and fitted on the instances of model1.
         
         
     Args:
@@ -98,8 +237,7 @@ class CombineOperator(FeatureOperator):
         FeatureOperator.__init__(self, model1, model2)
 
     def compute(self, X, y):
-        A = self.model1.compute(X, y)
-        B = self.model2.compute(X, y)
+        A, B = self.compute_branches(X, y)
         C = []
         for i in range(0, len(A)):
             ai = np.asarray(A[i]).reshape(1, -1)
@@ -108,8 +246,7 @@ class CombineOperator(FeatureOperator):
         return C
 
     def extract(self, X):
-        ai = self.model1.extract(X)
-        bi = self.model2.extract(X)
+        ai, bi = self.extract_branches(X)
         ai = np.asarray(ai).reshape(1, -1)
         bi = np.asarray(bi).reshape(1, -1)
         return np.hstack((ai, bi))
@@ -135,8 +272,7 @@ class CombineOperatorND(FeatureOperator):
         self._hstack = hstack
 
     def compute(self, X, y):
-        A = self.model1.compute(X, y)
-        B = self.model2.compute(X, y)
+        A, B = self.compute_branches(X, y)
         C = []
         for i in range(0, len(A)):
             if self._hstack:
@@ -146,8 +282,7 @@ class CombineOperatorND(FeatureOperator):
         return C
 
     def extract(self, X):
-        ai = self.model1.extract(X)
-        bi = self.model2.extract(X)
+        ai, bi = self.extract_branches(X)
         if self._hstack:
             return np.hstack((ai, bi))
         return np.vstack((ai, bi))
@@ -32,55 +32,158 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import cv2
 import numpy as np
 from ocvfacerec.facerec.feature import AbstractFeature
-from ocvfacerec.facerec.util import as_column_matrix
 from ocvfacerec.facerec.lbp import ExtendedLBP
-from cvfacerec.facerec.normalization import zscore, minmax
+from ocvfacerec.facerec.normalization import zscore, minmax, streaming_minmax, streaming_mean_std
 from scipy import ndimage
-from scipy.misc import imresize
 
 
 class Resize(AbstractFeature):
-    def __init__(self, size):
+    """
+    Resizes images with cv2.resize.
+
+    Args:
+        size [tuple] output size as (height, width), as scipy.misc.imresize expected it
+        interpolation [int] OpenCV interpolation flag. If None, cv2.INTER_AREA is used
+            for downscaling and cv2.INTER_LINEAR otherwise.
+        dtype [numpy.dtype] dtype of the resized images, None keeps the input dtype (default: None).
+            Float images resized to np.uint8 are scaled into [0, 255] like scipy.misc.imresize
+            did, other integer dtypes are clipped to their range.
+    """
+    stateless = True
+
+    def __init__(self, size, interpolation=None, dtype=None):
         AbstractFeature.__init__(self)
         self._size = size
+        self._interpolation = interpolation
+        self._dtype = dtype
 
     def compute(self, X, y):
-        Xp = []
-        for xi in X:
-            Xp.append(self.extract(xi))
-        return Xp
+        if len(X) == 0:
+            return []
+        if any([np.ndim(xi) != 2 for xi in X]):
+            # multi-channel images don't fit into the [num_images x height x width] batch
+            return [self.extract(xi) for xi in X]
+        return self.extract_batch(X)
 
     def extract(self, X):
-        return imresize(X, self._size)
+        X = np.asarray(X)
+        Xp = cv2.resize(X, (self._size[1], self._size[0]), interpolation=self._get_interpolation(X))
+        return self._cast(Xp)
+
+    def _cast(self, X):
+        if self._dtype is None or X.dtype == self._dtype:
+            return X
+        dtype = np.dtype(self._dtype)
+        if X.dtype.kind == 'f' and dtype.kind in 'ui':
+            if dtype == np.uint8:
+                # scale the value range into [0, 255], as scipy.misc.imresize did
+                low, high = float(X.min()), float(X.max())
+                if high > low:
+                    X = np.round((X - low) * (255.0 / (high - low)))
+            info = np.iinfo(dtype)
+            X = np.clip(X, info.min, info.max)
+        return np.asarray(X, dtype=dtype)
+
+    def extract_batch(self, X, out=None):
+        """
+        Resizes a sequence of grayscale images into a [num_images x height x width] array.
+
+        Args:
+            X [list] images (or a [num_images x rows x cols] array)
+            out [numpy.ndarray] optional preallocated output array
+        """
+        if out is None:
+            dtype = self._dtype
+            if dtype is None and len(X) > 0:
+                dtype = np.asarray(X[0]).dtype
+            out = np.empty((len(X), self._size[0], self._size[1]), dtype=dtype)
+        dsize = (self._size[1], self._size[0])
+        for i, xi in enumerate(X):
+            xi = np.asarray(xi)
+            if xi.dtype == out.dtype and xi.ndim == 2:
+                Xp = cv2.resize(xi, dsize, dst=out[i], interpolation=self._get_interpolation(xi))
+                # OpenCV allocates a new array, if it can't write into dst
+                if Xp.ctypes.data != out[i].ctypes.data:
+                    out[i] = Xp
+            else:
+                out[i] = self._cast(cv2.resize(xi, dsize, interpolation=self._get_interpolation(xi)))
+        return out
+
+    def _get_interpolation(self, X):
+        if self._interpolation is not None:
+            return self._interpolation
+        if X.shape[0] * X.shape[1] > self._size[0] * self._size[1]:
+            return cv2.INTER_AREA
+        return cv2.INTER_LINEAR
 
     def __repr__(self):
-        return "Resize (size=%s)" % (self._size,)
+        return "Resize (size=%s, interpolation=%s, dtype=%s)" % (self._size, self._interpolation, self._dtype)
 
 
 class HistogramEqualization(AbstractFeature):
+    stateless = True
+
     def __init__(self, num_bins=256):
         AbstractFeature.__init__(self)
         self._num_bins = num_bins
 
     def compute(self, X, y):
+        if isinstance(X, np.ndarray) and X.ndim == 3 and X.dtype == np.uint8:
+            return self.extract_batch(X)
         Xp = []
         for xi in X:
             Xp.append(self.extract(xi))
         return Xp
 
     def extract(self, X):
+        X = np.asarray(X)
+        if X.dtype == np.uint8:
+            counts = np.bincount(X.ravel(), minlength=256)
+            return self._lut(counts)[X]
         h, b = np.histogram(X.flatten(), self._num_bins, normed=True)
         cdf = h.cumsum()
         cdf = 255 * cdf / cdf[-1]
         return np.interp(X.flatten(), b[:-1], cdf).reshape(X.shape)
 
+    def extract_batch(self, X):
+        """
+        Equalizes a stack of uint8 images [num_images x height x width] at once.
+        Each image still gets its own histogram, but the pixel counts of all
+        images are gathered in a single bincount.
+        """
+        X = np.asarray(X, dtype=np.uint8)
+        n = X.shape[0]
+        offsets = (np.arange(n) * 256).reshape(-1, 1)
+        counts = np.bincount((X.reshape(n, -1) + offsets).ravel(), minlength=256 * n).reshape(n, 256)
+        luts = np.vstack([self._lut(c) for c in counts])
+        return luts[np.arange(n).reshape(-1, 1, 1), X]
+
+    def _lut(self, counts):
+        # Builds the 256-entry lookup table, which yields the same values as
+        # the np.histogram/np.interp path for an image with the given counts.
+        values = np.nonzero(counts)[0]
+        low, high = float(values[0]), float(values[-1])
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        edges = np.linspace(low, high, self._num_bins + 1)
+        bins = np.clip(np.searchsorted(edges, np.arange(256), side='right') - 1, 0, self._num_bins - 1)
+        h = np.bincount(bins, weights=counts, minlength=self._num_bins)
+        cdf = h.cumsum()
+        cdf = 255 * cdf / cdf[-1]
+        return np.interp(np.arange(256), edges[:-1], cdf)
+
     def __repr__(self):
         return "HistogramEqualization (num_bins=%s)" % (self._num_bins)
 
 
 class TanTriggsPreprocessing(AbstractFeature):
+    stateless = True
+    fusable = True
+    fused_dtype = np.float32
+
     def __init__(self, alpha=0.1, tau=10.0, gamma=0.2, sigma0=1.0, sigma1=2.0):
         AbstractFeature.__init__(self)
         self._alpha = float(alpha)
@@ -96,12 +199,19 @@ class TanTriggsPreprocessing(AbstractFeature):
         return Xp
 
     def extract(self, X):
-        X = np.array(X, dtype=np.float32)
-        X = np.power(X, self._gamma)
-        X = np.asarray(ndimage.gaussian_filter(X, self._sigma1) - ndimage.gaussian_filter(X, self._sigma0))
-        X = X / np.power(np.mean(np.power(np.abs(X), self._alpha)), 1.0 / self._alpha)
-        X = X / np.power(np.mean(np.power(np.minimum(np.abs(X), self._tau), self._alpha)), 1.0 / self._alpha)
-        X = self._tau * np.tanh(X / self._tau)
+        return self.extract_inplace(np.array(X, dtype=np.float32))
+
+    def extract_inplace(self, X):
+        np.power(X, self._gamma, out=X)
+        # difference of gaussians, the wider blur needs the only extra image
+        blurred = ndimage.gaussian_filter(X, self._sigma1)
+        ndimage.gaussian_filter(X, self._sigma0, output=X)
+        np.subtract(blurred, X, out=X)
+        X /= np.power(np.mean(np.power(np.abs(X), self._alpha)), 1.0 / self._alpha)
+        X /= np.power(np.mean(np.power(np.minimum(np.abs(X), self._tau), self._alpha)), 1.0 / self._alpha)
+        X /= self._tau
+        np.tanh(X, out=X)
+        X *= self._tau
         return X
 
     def __repr__(self):
@@ -110,6 +220,8 @@ class TanTriggsPreprocessing(AbstractFeature):
 
 
 class LBPPreprocessing(AbstractFeature):
+    stateless = True
+
     def __init__(self, lbp_operator=ExtendedLBP(radius=1, neighbors=8)):
         AbstractFeature.__init__(self)
         self._lbp_operator = lbp_operator
@@ -128,16 +240,18 @@ class LBPPreprocessing(AbstractFeature):
 
 
 class MinMaxNormalizePreprocessing(AbstractFeature):
+    fusable = True
+
     def __init__(self, low=0, high=1):
         AbstractFeature.__init__(self)
         self._low = low
         self._high = high
 
     def compute(self, X, y):
+        if not isinstance(X, (list, np.ndarray)):
+            X = list(X)
+        self._min, self._max = streaming_minmax(X)
         Xp = []
-        XC = as_column_matrix(X)
-        self._min = np.min(XC)
-        self._max = np.max(XC)
         for xi in X:
             Xp.append(self.extract(xi))
         return Xp
@@ -145,20 +259,27 @@ class MinMaxNormalizePreprocessing(AbstractFeature):
     def extract(self, X):
         return minmax(X, self._low, self._high, self._min, self._max)
 
+    def extract_inplace(self, X):
+        return minmax(X, self._low, self._high, self._min, self._max, copy=False)
+
     def __repr__(self):
         return "MinMaxNormalizePreprocessing (low=%s, high=%s)" % (self._low, self._high)
 
 
 class ZScoreNormalizePreprocessing(AbstractFeature):
+    fusable = True
+    # zscore keeps the dtype of float images
+    fused_dtype = None
+
     def __init__(self):
         AbstractFeature.__init__(self)
         self._mean = 0.0
         self._std = 1.0
 
     def compute(self, X, y):
-        XC = as_column_matrix(X)
-        self._mean = XC.mean()
-        self._std = XC.std()
+        if not isinstance(X, (list, np.ndarray)):
+            X = list(X)
+        self._mean, self._std = streaming_mean_std(X)
         Xp = []
         for xi in X:
             Xp.append(self.extract(xi))
@@ -167,5 +288,8 @@ class ZScoreNormalizePreprocessing(AbstractFeature):
     def extract(self, X):
         return zscore(X, self._mean, self._std)
 
+    def extract_inplace(self, X):
+        return zscore(X, self._mean, self._std, copy=False)
+
     def __repr__(self):
         return "ZScoreNormalizePreprocessing (mean=%s, std=%s)" % (self._mean, self._std)
@@ -31,19 +31,285 @@
 # LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
-
 import cPickle
+from cStringIO import StringIO
+import os
+import struct
+import time
+import zlib
+import logging
+import numpy as np
+from ocvfacerec.facerec.util import as_rows
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Binary model format:
+#
+#   prefix    magic, format version, lengths of the two pickles (little endian)
+#   metadata  pickle of a dict with the image size and subject names
+#   model     pickle of the model, every large array is replaced by a reference
+#   data      the referenced arrays as raw C-ordered bytes, each aligned to ALIGNMENT
+#
+# The data section is mapped into memory on loading, so the arrays are views of
+# the file. Processes loading the same model share its physical pages.
+#
+# Samples enrolled after saving are appended to a gallery log next to the model file
+# (see append_gallery), which load_model replays. Every save_model writes a new
+# generation into the metadata and log records only apply to the generation they
+# were appended to, so a newly saved model never replays an outdated log.
+MAGIC = "OCVFREC\0"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# Arrays smaller than this are pickled inline.
+MIN_ARRAY_BYTES = 1024
+
+_prefix = struct.Struct("<8sIQQ")
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def model_metadata(model):
+    """ Returns the metadata stored in the header of a model file.
+    """
+    return {
+        'image_size': getattr(model, 'image_size', None),
+        'subject_names': getattr(model, 'subject_names', None)
+    }
 
 
 def save_model(filename, model):
-    output = open(filename, 'wb')
-    cPickle.dump(model, output)
-    output.close()
+    """ Saves a model in the binary format. The file is written next to filename
+        and renamed, so readers never see a partially written model.
+    """
+    arrays = []
+    offsets = {}
+    size = [0]
 
+    def persistent_id(obj):
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject or obj.nbytes < MIN_ARRAY_BYTES:
+            return None
+        key = id(obj)
+        if key not in offsets:
+            offset = _align(size[0])
+            offsets[key] = offset
+            size[0] = offset + obj.nbytes
+            # keep a reference, so the id isn't reused while pickling
+            arrays.append((offset, obj))
+        return "array", offsets[key], obj.dtype.str, obj.shape, isinstance(obj, np.matrix)
 
-def load_model(filename):
-    pkl_file = open(filename, 'rb')
-    res = cPickle.load(pkl_file)
-    pkl_file.close()
-    print ">> New Model Loaded"
+    metadata = model_metadata(model)
+    metadata['generation'] = os.urandom(8).encode('hex')
+    metadata = cPickle.dumps(metadata, cPickle.HIGHEST_PROTOCOL)
+    output = StringIO()
+    pickler = cPickle.Pickler(output, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(model)
+    model_pickle = output.getvalue()
+
+    tmp_filename = "%s.tmp%d" % (filename, os.getpid())
+    with open(tmp_filename, 'wb') as f:
+        f.write(_prefix.pack(MAGIC, FORMAT_VERSION, len(metadata), len(model_pickle)))
+        f.write(metadata)
+        f.write(model_pickle)
+        position = 0
+        data_start = _align(f.tell())
+        f.write("\0" * (data_start - f.tell()))
+        for offset, array in arrays:
+            f.write("\0" * (offset - position))
+            np.ascontiguousarray(array).tofile(f)
+            position = offset + array.nbytes
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_filename, filename)
+
+
+def _read_prefix(f):
+    prefix = f.read(_prefix.size)
+    if len(prefix) < _prefix.size:
+        return None
+    magic, version, metadata_length, model_length = _prefix.unpack(prefix)
+    if magic != MAGIC:
+        return None
+    if version > FORMAT_VERSION:
+        raise ValueError("Model format version %d is newer than the supported version %d." % (
+            version, FORMAT_VERSION))
+    return version, metadata_length, model_length
+
+
+def is_binary_model(filename):
+    """ Returns True if filename is a model in the binary format (and not a legacy pickle).
+    """
+    with open(filename, 'rb') as f:
+        return _read_prefix(f) is not None
+
+
+def load_metadata(filename):
+    """ Reads only the metadata (image size, subject names) of a binary model file.
+    """
+    with open(filename, 'rb') as f:
+        header = _read_prefix(f)
+        if header is None:
+            raise ValueError("%s is not a binary model file." % filename)
+        return cPickle.loads(f.read(header[1]))
+
+
+def load_model(filename, mmap_mode='r'):
+    """ Loads a model saved by save_model. The arrays are memory-mapped with the given
+        mmap_mode ('r' shares the read-only pages of the file, None reads them into memory).
+        Samples appended to the gallery log of the model are added to its classifier.
+        Models pickled by former versions are still loaded.
+    """
+    start = time.time()
+    with open(filename, 'rb') as f:
+        header = _read_prefix(f)
+        if header is None:
+            f.seek(0)
+            res = cPickle.load(f)
+        else:
+            version, metadata_length, model_length = header
+            metadata = cPickle.loads(f.read(metadata_length))
+            model_pickle = f.read(model_length)
+            data_start = _align(f.tell())
+            # map the open file, a model saved meanwhile replaces the name but not this file
+            if mmap_mode is None:
+                f.seek(0)
+                data = np.fromfile(f, dtype=np.uint8)
+            else:
+                data = np.memmap(f, dtype=np.uint8, mode=mmap_mode)
+            res = _unpickle_model(data, model_pickle, data_start)
+            if 'generation' in metadata:
+                replay_gallery(filename, res, metadata['generation'])
+    print ">> New Model Loaded (%.3fs)" % (time.time() - start)
     return res
+
+
+def _unpickle_model(data, model_pickle, data_start):
+    def persistent_load(pid):
+        kind, offset, dtype, shape, matrix = pid
+        if kind != "array":
+            raise cPickle.UnpicklingError("Unknown reference %r in model file." % (kind,))
+        dtype = np.dtype(dtype)
+        start = data_start + offset
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        array = np.asarray(data[start:start + nbytes]).view(dtype).reshape(shape)
+        if matrix:
+            array = np.asmatrix(array)
+        return array
+
+    unpickler = cPickle.Unpickler(StringIO(model_pickle))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+# Gallery log record: magic, model generation, payload length, crc32 of the payload.
+# The payload is a pickle of (features, labels, subject_names, sample_shape).
+LOG_MAGIC = "OGAL"
+_log_record = struct.Struct("<4s16sQI")
+
+
+def gallery_log_filename(filename):
+    return filename + ".log"
+
+
+class _LockedLog(object):
+    """ The gallery log of a model, opened for appending and locked exclusively
+        (where fcntl is available).
+    """
+
+    def __init__(self, filename):
+        self.filename = gallery_log_filename(filename)
+
+    def __enter__(self):
+        self.f = open(self.filename, 'ab')
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self.f
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        self.f.close()
+
+
+def append_gallery(filename, X, y, subject_names=None):
+    """ Appends samples to the gallery log of a binary model file, instead of rewriting it.
+
+    Args:
+
+        filename: The model file.
+        X: The features of the samples, as extracted by the model's feature.
+        y: The labels of the samples.
+        subject_names: A dict with names for the (new) labels.
+    """
+    features = as_rows(X)
+    payload = cPickle.dumps((features, np.asarray(y), subject_names or {}, np.shape(X[0])),
+                            cPickle.HIGHEST_PROTOCOL)
+    with _LockedLog(filename) as f:
+        # read the generation with the lock held, a compaction can't replace the model meanwhile
+        generation = load_metadata(filename).get('generation')
+        if generation is None:
+            raise ValueError("%s was saved without a generation, save it again to append to its gallery." % filename)
+        f.write(_log_record.pack(LOG_MAGIC, generation, len(payload), zlib.crc32(payload) & 0xffffffff))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_gallery_log(filename, generation):
+    """ Returns the (features, labels, subject_names, sample_shape) records of the gallery log, which
+        belong to the given model generation. Reading stops at an incomplete or corrupt
+        record, as left by an interrupted append.
+    """
+    logger = logging.getLogger("facerec.serialization")
+    records = []
+    log_filename = gallery_log_filename(filename)
+    if not os.path.exists(log_filename):
+        return records
+    with open(log_filename, 'rb') as f:
+        while True:
+            header = f.read(_log_record.size)
+            if len(header) == 0:
+                break
+            if len(header) < _log_record.size:
+                logger.warning("Ignoring an incomplete record at the end of %s." % log_filename)
+                break
+            magic, record_generation, length, crc = _log_record.unpack(header)
+            payload = f.read(length) if magic == LOG_MAGIC else ""
+            if len(payload) < length or magic != LOG_MAGIC or (zlib.crc32(payload) & 0xffffffff) != crc:
+                logger.warning("Ignoring a corrupt record and everything after it in %s." % log_filename)
+                break
+            if record_generation == generation:
+                records.append(cPickle.loads(payload))
+    return records
+
+
+def replay_gallery(filename, model, generation):
+    """ Adds the samples of the gallery log to the classifier of the model.
+    """
+    for features, labels, subject_names, sample_shape in read_gallery_log(filename, generation):
+        model.classifier.update([x.reshape(sample_shape) for x in features], labels)
+        if subject_names and hasattr(model, 'subject_names'):
+            model.subject_names.update(subject_names)
+
+
+def compact_gallery(filename, transform=None):
+    """ Saves the model with its gallery log replayed and empties the log. If given,
+        transform(model) is called before saving, to change the model in between.
+
+    Returns:
+
+        The saved model.
+    """
+    with _LockedLog(filename) as f:
+        # appends wait for the lock, so no record gets lost in between
+        model = load_model(filename, mmap_mode=None)
+        if transform is not None:
+            transform(model)
+        save_model(filename, model)
+        f.truncate(0)
+    return model
@@ -32,10 +32,12 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from classifier import SVM
-from ocvfacerec.facerec.validation import KFoldCrossValidation
+from classifier import SVM, svm_parameter_fields
+from ocvfacerec.facerec.validation import StratifiedKFold, split_stateless
 from ocvfacerec.facerec.model import PredictableModel
-from ocvfacerec.facerec.svmutil import *
+from ocvfacerec.facerec.distance import EuclideanDistance
+from ocvfacerec.facerec.util import as_rows, worker_pool, worker_data
+from svmutil import *
 from itertools import product
 import numpy as np
 import logging
@@ -60,7 +62,111 @@ def grid(grid_parameters):
     return product(*grid)
 
 
-def grid_search(model, X, y, C_range=(-5, 15, 2), gamma_range=(3, -15, -2), k=5, num_cores=1):
+# svm_parameter can't be pickled for the worker processes, so only its plain fields are
+# passed and copied into a fresh svm_parameter.
+def get_parameter_fields(param):
+    return dict((name, getattr(param, name)) for name in svm_parameter_fields)
+
+
+def make_parameter(fields, C, gamma):
+    param = svm_parameter("-q")
+    for name, value in fields.iteritems():
+        setattr(param, name, value)
+    param.C, param.gamma = C, gamma
+    return param
+
+
+def fold_features(model, X, y, k=5, seed=None):
+    """ Computes the features of a k-fold cross validation once. The features do not
+        depend on the SVM parameters, so all grid points are evaluated on them.
+
+    Returns:
+
+        A list with (Xtrain, ytrain, Xtest, ytest) for every fold, where the features
+        are given as rows.
+    """
+    y = np.asarray(y)
+    prefix, cv_model = split_stateless(model)
+    if prefix is not None:
+        X = prefix.compute(X, y)
+    folds = []
+    for trainIdx, testIdx in StratifiedKFold(y, k, seed):
+        ytrain = y[trainIdx]
+        train_features = cv_model.feature.compute([X[t] for t in trainIdx], ytrain)
+        # the feature is fitted on this fold now, so extract the test samples right away
+        test_features = [cv_model.feature.extract(X[t]) for t in testIdx]
+        folds.append((as_rows(train_features), ytrain, as_rows(test_features), y[testIdx]))
+    return folds
+
+
+def distance_folds(folds):
+    """ Replaces the features of each fold by the squared distances to the training
+        samples. The RBF kernel of any gamma is then exp(-gamma * D).
+    """
+    squared_distances = EuclideanDistance().squared_pairwise
+    return [(squared_distances(Xtrain, Xtrain), ytrain, squared_distances(Xtest, Xtrain), ytest)
+            for Xtrain, ytrain, Xtest, ytest in folds]
+
+
+def kernel_folds(folds, kernel_function):
+    """ Replaces the features of each fold by the kernel matrices of a fixed kernel
+        (see facerec.kernel).
+    """
+    return [(kernel_function(Xtrain, Xtrain), ytrain, kernel_function(Xtest, Xtrain), ytest)
+            for Xtrain, ytrain, Xtest, ytest in folds]
+
+
+def evaluate_parameter(folds, fields, C, gamma, precomputed=None):
+    """ Returns the cross validated accuracy of a SVM with the given C and gamma. If
+        precomputed is "rbf", the folds hold squared distances (see distance_folds) and
+        the SVM is trained on the precomputed RBF kernel. If precomputed is "kernel",
+        the folds hold kernel matrices (see kernel_folds) and gamma is ignored.
+    """
+    correct, total = 0, 0
+    for Xtrain, ytrain, Xtest, ytest in folds:
+        svm = SVM(make_parameter(fields, C, gamma))
+        if precomputed == "rbf":
+            svm.compute_kernel(np.exp(-gamma * Xtrain), ytrain)
+            predictions = [p[0] for p in svm.predict_kernel_batch(np.exp(-gamma * Xtest))]
+        elif precomputed == "kernel":
+            svm.compute_kernel(Xtrain, ytrain)
+            predictions = [p[0] for p in svm.predict_kernel_batch(Xtest)]
+        else:
+            svm.compute(Xtrain, ytrain)
+            predictions = [p[0] for p in svm.predict_batch(Xtest)]
+        correct = correct + int(np.sum(np.asarray(predictions) == ytest))
+        total = total + len(ytest)
+    return correct / float(max(total, 1))
+
+
+def _evaluate_worker(p):
+    C, gamma = p
+    data = worker_data()
+    return evaluate_parameter(data['folds'], data['fields'], 2 ** C, 2 ** gamma, data['precomputed'])
+
+
+def grid_search(model, X, y, C_range=(-5, 15, 2), gamma_range=(3, -15, -2), k=5, num_cores=1, refine=0,
+                seed=None):
+    """ Searches the best C and gamma (on a log2 scale) by a k-fold cross validation.
+
+    Args:
+
+        model [PredictableModel] model with a SVM classifier
+        X [list] input data
+        y [list] classes
+        C_range [tuple] (begin, end, step) of the log2(C) grid
+        gamma_range [tuple] (begin, end, step) of the log2(gamma) grid
+        k [int] number of folds
+        num_cores [int] number of processes evaluating the grid points
+        refine [int] number of coarse-to-fine refinements, each one evaluates a grid
+            with half the step width around the best cell found so far
+        seed [int] seed of the fold assignment, to reproduce the search
+
+    Returns:
+
+        (best_parameter, results) with the best svm_parameter and a list of
+        [C, gamma, accuracy] for every evaluated grid point.
+    """
     if not isinstance(model, PredictableModel):
         raise TypeError(
             "GridSearch expects a PredictableModel. If you want to perform optimization on raw data use facerec.feature.Identity to pass unpreprocessed data!")
@@ -75,35 +181,70 @@ def grid_search(model, X, y, C_range=(-5, 15, 2), gamma_range=(3, -15, -2), k=5,
     best_parameter.kernel_type = model.classifier.param.kernel_type
     best_parameter.nu = model.classifier.param.nu
     best_parameter.coef0 = model.classifier.param.coef0
-    # either no gamma given or kernel is linear (only C to optimize)
-    if (gamma_range is None) or (model.classifier.param.kernel_type == LINEAR):
+    # either no gamma given or kernel is linear or a fixed precomputed kernel (only C to optimize)
+    optimize_gamma = not ((gamma_range is None) or (model.classifier.param.kernel_type == LINEAR) or
+                          (model.classifier.kernel is not None))
+    if not optimize_gamma:
         gamma_range = (0, 0, 1)
 
+    # the features don't depend on C or gamma, so they are computed only once per fold
+    logger.info("Computing the features of %d folds." % k)
+    folds = fold_features(model, X, y, k, seed)
+    fields = get_parameter_fields(model.classifier.param)
+    precomputed = None
+    if model.classifier.kernel is not None:
+        # a fixed kernel doesn't depend on C, so it is computed once per fold
+        logger.info("Precomputing the %s kernel." % (model.classifier.kernel))
+        precomputed = "kernel"
+        folds = kernel_folds(folds, model.classifier.kernel_function)
+    elif model.classifier.param.kernel_type == RBF:
+        # the squared distances of a fold are the same for all gammas of a RBF kernel
+        logger.info("Precomputing the squared distances for the RBF kernel.")
+        precomputed = "rbf"
+        folds = distance_folds(folds)
+
     # best validation error so far
     best_accuracy = np.finfo('float').min
+    best_point = None
 
-    # create grid (cartesian product of ranges)        
-    g = grid([C_range, gamma_range])
+    pool = None
+    if num_cores > 1:
+        pool = worker_pool(num_cores, folds=folds, fields=fields, precomputed=precomputed)
     results = []
-    for p in g:
-        C, gamma = p
-        C, gamma = 2 ** C, 2 ** gamma
-        model.classifier.param.C, model.classifier.param.gamma = C, gamma
-
-        # perform a k-fold cross validation
-        cv = KFoldCrossValidation(model=model, k=k)
-        cv.validate(X, y)
-
-        # append parameter into list with accuracies for all parameter combinations
-        results.append([C, gamma, cv.accuracy])
-
-        # store best parameter combination
-        if cv.accuracy > best_accuracy:
-            logger.info("best_accuracy=%s" % (cv.accuracy))
-            best_accuracy = cv.accuracy
-            best_parameter.C, best_parameter.gamma = C, gamma
-
-        logger.info("%d-CV Result = %.2f." % (k, cv.accuracy))
+    evaluated = set()
+    try:
+        for level in range(0, refine + 1):
+            # create grid (cartesian product of ranges), skipping points of coarser levels
+            points = [p for p in grid([C_range, gamma_range]) if p not in evaluated]
+            if pool is not None:
+                accuracies = pool.map(_evaluate_worker, points)
+            else:
+                accuracies = [evaluate_parameter(folds, fields, 2 ** C, 2 ** gamma, precomputed)
+                              for C, gamma in points]
+            for p, accuracy in zip(points, accuracies):
+                evaluated.add(p)
+                C, gamma = 2 ** p[0], 2 ** p[1]
+                # append parameter into list with accuracies for all parameter combinations
+                results.append([C, gamma, accuracy])
+                # store best parameter combination
+                if accuracy > best_accuracy:
+                    logger.info("best_accuracy=%s" % (accuracy))
+                    best_accuracy = accuracy
+                    best_point = p
+                    best_parameter.C, best_parameter.gamma = C, gamma
+                logger.info("%d-CV Result = %.2f." % (k, accuracy))
+            if best_point is None:
+                break
+            # refine around the best cell with half the step width
+            C_step = C_range[2]
+            C_range = (best_point[0] - C_step, best_point[0] + C_step, C_step / 2.0)
+            if optimize_gamma:
+                gamma_step = gamma_range[2]
+                gamma_range = (best_point[1] - gamma_step, best_point[1] + gamma_step, gamma_step / 2.0)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     # set best parameter combination to best found
     return best_parameter, results
@@ -34,6 +34,7 @@
 
 import numpy as np
 import random
+import multiprocessing
 from scipy import ndimage
 
 
@@ -50,6 +51,17 @@ def read_image(filename):
     return imarr
 
 
+def as_rows(X, dtype=None):
+    """
+    Turns a list of samples (or an array with one sample per row) into a [num_data x dim] array.
+    """
+    if len(X) == 0:
+        return np.empty((0, 0), dtype=dtype)
+    if isinstance(X, np.ndarray):
+        return np.asarray(X.reshape(X.shape[0], -1), dtype=dtype)
+    return np.vstack([np.asarray(x, dtype=dtype).reshape(1, -1) for x in X])
+
+
 def as_row_matrix(X):
     """
     Creates a row-matrix from multi-dimensional data items in list l.
@@ -58,13 +70,7 @@ def as_row_matrix(X):
     """
     if len(X) == 0:
         return np.array([])
-    total = 1
-    for i in range(0, np.ndim(X[0])):
-        total = total * X[0].shape[i]
-    mat = np.empty([0, total], dtype=X[0].dtype)
-    for row in X:
-        mat = np.append(mat, row.reshape(1, -1), axis=0)  # same as vstack
-    return np.asmatrix(mat)
+    return np.asmatrix(as_rows(X))
 
 
 def as_column_matrix(X):
@@ -127,6 +133,87 @@ def shuffle_array(X, y):
     X = [X[i] for i in idx]
     y = [y[i] for i in idx]
     return (X, y)
-    
 
 
+def array_nbytes(obj, seen=None):
+    """ Sums up the bytes of all numpy arrays reachable from obj through lists, tuples,
+        dicts and object attributes. Every object is only counted once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum([array_nbytes(value, seen) for value in obj.values()])
+    if isinstance(obj, (list, tuple)):
+        return sum([array_nbytes(value, seen) for value in obj])
+    if hasattr(obj, '__dict__'):
+        return array_nbytes(obj.__dict__, seen)
+    return 0
+
+
+def _memory_status(field):
+    """ Returns a memory field of /proc/self/status in bytes (None if unavailable).
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        pass
+    return None
+
+
+def reset_peak_memory():
+    """ Resets the peak resident set size of the current process to its current size
+        and returns that size in bytes, the baseline for peak_memory.
+
+        Only Linux (>= 4.0) can reset the peak, through /proc/self/clear_refs. Elsewhere
+        None is returned, because the peak of the process would include everything it
+        did before.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        return None
+    return _memory_status('VmRSS')
+
+
+def peak_memory(baseline):
+    """ Returns the peak resident set size in bytes the process grew by since
+        reset_peak_memory returned baseline (None if it can't be measured).
+    """
+    if baseline is None:
+        return None
+    peak = _memory_status('VmHWM')
+    if peak is None:
+        return None
+    return max(0, peak - baseline)
+
+
+# Data shared with the worker processes of a pool. It is passed once per worker
+# through the pool initializer, instead of once per task.
+_worker_data = {}
+
+
+def _init_worker_data(data):
+    _worker_data.clear()
+    _worker_data.update(data)
+
+
+def worker_pool(processes, **data):
+    """ Returns a multiprocessing.Pool, whose workers find the given keyword
+        arguments in worker_data().
+    """
+    return multiprocessing.Pool(processes=processes, initializer=_init_worker_data, initargs=(data,))
+
+
+def worker_data():
+    """ Returns the data given to worker_pool in a worker process.
+    """
+    return _worker_data
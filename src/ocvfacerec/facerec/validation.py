@@ -35,9 +35,12 @@
 import numpy as np
 import math as math
 import random as random
+import time
 import logging
 from ocvfacerec.facerec.model import PredictableModel
-from ocvfacerec.facerec.classifier import AbstractClassifier
+from ocvfacerec.facerec.classifier import AbstractClassifier, NearestNeighbor
+from ocvfacerec.facerec.operators import flatten_chain, build_chain
+from ocvfacerec.facerec.util import as_rows, array_nbytes, peak_memory, reset_peak_memory, worker_pool, worker_data
 
 # TODO The evaluation of a model should be completely moved to the generic ValidationStrategy. The specific Validation 
 # implementations should only care about partition the data, which would make a lot sense. Currently it is not
@@ -49,6 +52,10 @@ from ocvfacerec.facerec.classifier import AbstractClassifier
 #
 # Please be careful, when referring to the Performance Metrics at the moment, only the Precision is implemented,
 # and the rest has no use at the moment. Due to the missing refactoring discussed above.
+#
+# The strategies collect the predictions and distances of all folds as arrays, so the confusion matrix,
+# per-class precision/recall and the verification ROC (accepting predictions below a distance threshold)
+# are available from the ValidationResult.
 
 
 def shuffle(X, y):
@@ -115,21 +122,241 @@ def accuracy(true_positives, true_negatives, false_positives, false_negatives, d
     return (true_positives + true_negatives) / (true_positives + false_positives + true_negatives + false_negatives)
 
 
+def confusion_matrix(y_true, y_pred, num_classes=None):
+    """Returns the [num_classes x num_classes] confusion matrix, where rows are the
+       actual and columns the predicted classes.
+    """
+    y_true = np.asarray(y_true, dtype=np.int)
+    y_pred = np.asarray(y_pred, dtype=np.int)
+    if num_classes is None:
+        num_classes = max(y_true.max(), y_pred.max()) + 1 if y_true.size > 0 else 0
+    counts = np.bincount(y_true * num_classes + y_pred, minlength=num_classes * num_classes)
+    return counts.reshape(num_classes, num_classes)
+
+
+def precision_recall(cm):
+    """Returns the per-class precision and recall of a confusion matrix. Classes,
+       which were never predicted (or never present), get a precision (or recall) of 0.
+    """
+    cm = np.asarray(cm, dtype=np.float)
+    true_positives = np.diag(cm)
+    predicted = cm.sum(axis=0)
+    actual = cm.sum(axis=1)
+    class_precision = np.where(predicted > 0, true_positives / np.maximum(predicted, 1), 0.0)
+    class_recall = np.where(actual > 0, true_positives / np.maximum(actual, 1), 0.0)
+    return class_precision, class_recall
+
+
+def roc_curve(genuine, distances):
+    """Returns the verification ROC for a reject threshold on the classifier distance:
+       a prediction is accepted, if its distance is <= threshold. Correct predictions
+       are genuine, wrong predictions are impostors.
+
+    Args:
+
+        genuine [1 x num_data] True for correct predictions
+        distances [1 x num_data] distances of the predictions
+
+    Returns:
+
+        (thresholds, far, frr) with the false acceptance and false rejection rate
+        for every distinct threshold, starting with a threshold rejecting everything.
+    """
+    genuine = np.asarray(genuine, dtype=np.bool)
+    distances = np.asarray(distances, dtype=np.float)
+    valid = ~np.isnan(distances)
+    genuine, distances = genuine[valid], distances[valid]
+    order = np.argsort(distances, kind='mergesort')
+    distances, genuine = distances[order], genuine[order]
+    accepted_genuine = np.cumsum(genuine)
+    accepted_impostors = np.cumsum(~genuine)
+    # only keep the last position of every distinct distance
+    last = np.append(np.nonzero(np.diff(distances))[0], distances.size - 1) if distances.size > 0 else []
+    num_genuine = max(genuine.sum(), 1)
+    num_impostors = max((~genuine).sum(), 1)
+    thresholds = np.append(-np.inf, distances[last])
+    far = np.append(0.0, accepted_impostors[last] / float(num_impostors))
+    frr = np.append(1.0, 1.0 - accepted_genuine[last] / float(num_genuine))
+    return thresholds, far, frr
+
+
+def equal_error_rate(thresholds, far, frr):
+    """Returns (eer, threshold) at the point of the ROC, where FAR and FRR are closest.
+    """
+    i = np.argmin(np.abs(far - frr))
+    return (far[i] + frr[i]) / 2.0, thresholds[i]
+
+
+def predict_all(model, X, indices):
+    """ Predicts the samples X[i] for all given indices.
+
+    Returns:
+
+        (predictions, distances, predict_times) arrays. The distance is the one of the
+        nearest neighbor, if the classifier reports distances, and NaN otherwise. The
+        predict_times are the latencies of the single predictions in seconds.
+    """
+    predictions = np.empty(len(indices), dtype=np.int)
+    distances = np.empty(len(indices), dtype=np.float)
+    predict_times = np.empty(len(indices), dtype=np.float)
+    for i, j in enumerate(indices):
+        start = time.time()
+        prediction = model.predict(X[j])
+        predict_times[i] = time.time() - start
+        predictions[i] = prediction[0]
+        try:
+            distances[i] = prediction[1]['distances'][0]
+        except (KeyError, IndexError, TypeError):
+            distances[i] = np.nan
+    return predictions, distances, predict_times
+
+
+def split_stateless(model):
+    """ Splits a model into the leading stateless stages of its feature and a
+        PredictableModel of the remaining stages with the same classifier.
+
+        Returns:
+
+            (prefix, model), where prefix is None if the feature does not start with
+            a stateless stage. If all stages are stateless, the model uses the Identity.
+    """
+    stages = flatten_chain(model.feature)
+    n = 0
+    while n < len(stages) and stages[n].stateless:
+        n = n + 1
+    if n == 0:
+        return None, model
+    return build_chain(stages[:n]), PredictableModel(build_chain(stages[n:]), model.classifier)
+
+
+def evaluate_fold(model, X, y, trainIdx, testIdx):
+    """ Computes the model on the training indices and predicts the test indices.
+
+    Returns:
+
+        (y_true, y_pred, distances, statistics) of the fold, where statistics is a
+        FoldStatistics with the timings and memory usage.
+    """
+    y = np.asarray(y)
+    Xtrain = [X[t] for t in trainIdx]
+    ytrain = y[trainIdx]
+    baseline = reset_peak_memory()
+    # same as model.compute, but timing the feature extraction and classifier separately
+    start = time.time()
+    features = model.feature.compute(Xtrain, ytrain)
+    feature_time = time.time() - start
+    start = time.time()
+    model.classifier.compute(features, ytrain)
+    train_time = time.time() - start
+    predictions, distances, predict_times = predict_all(model, X, testIdx)
+    statistics = FoldStatistics(feature_time, train_time, predict_times, peak_memory(baseline),
+                                array_nbytes(model))
+    return y[testIdx], predictions, distances, statistics
+
+
+def _seed_fold(seed):
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
+
+def _evaluate_fold_worker(args):
+    trainIdx, testIdx, seed = args
+    _seed_fold(seed)
+    # every worker process holds its own copy of the model
+    data = worker_data()
+    return evaluate_fold(data['model'], data['X'], data['y'], trainIdx, testIdx)
+
+
+class FoldStatistics(object):
+    """Holds the timings (in seconds) and memory usage (in bytes) of a single fold. The
+       peak memory is what the fold added to the resident set size, None if it can't
+       be measured on this platform.
+    """
+
+    def __init__(self, feature_time, train_time, predict_times, peak_memory, model_bytes):
+        self.feature_time = feature_time
+        self.train_time = train_time
+        self.predict_times = np.asarray(predict_times, dtype=np.float)
+        self.peak_memory = peak_memory
+        self.model_bytes = model_bytes
+
+    def predict_percentiles(self, q=(50, 90, 99)):
+        if self.predict_times.size == 0:
+            return [np.nan for i in q]
+        return [np.percentile(self.predict_times, i) for i in q]
+
+    def __repr__(self):
+        p50, p90, p99 = self.predict_percentiles()
+        peak = ""
+        if self.peak_memory is not None:
+            peak = ", Peak RSS=+%.1fMB" % (self.peak_memory / (1024.0 * 1024.0))
+        return "FoldStatistics (Features=%.1fms, Training=%.1fms, Predict p50/p90/p99=%.2f/%.2f/%.2fms, " \
+               "Model=%.1fKB%s)" % (self.feature_time * 1000, self.train_time * 1000, p50 * 1000,
+                                    p90 * 1000, p99 * 1000, self.model_bytes / 1024.0, peak)
+
+
 class ValidationResult(object):
-    """Holds a validation result.
+    """Holds a validation result. If the predictions are given, the confusion matrix,
+       per-class precision/recall and the verification ROC are computed from them.
     """
 
-    def __init__(self, true_positives, true_negatives, false_positives, false_negatives, description):
+    def __init__(self, true_positives, true_negatives, false_positives, false_negatives, description, y_true=None,
+                 y_pred=None, distances=None, fold_statistics=None):
         self.true_positives = true_positives
         self.true_negatives = true_negatives
         self.false_positives = false_positives
         self.false_negatives = false_negatives
         self.description = description
+        self.y_true = y_true
+        self.y_pred = y_pred
+        self.distances = distances
+        self.fold_statistics = fold_statistics or []
+
+    @staticmethod
+    def from_predictions(y_true, y_pred, distances, description, fold_statistics=None):
+        """Creates a ValidationResult from the collected predictions, counting correct
+           predictions as true positives and wrong ones as false positives.
+        """
+        y_true = np.asarray(y_true, dtype=np.int)
+        y_pred = np.asarray(y_pred, dtype=np.int)
+        true_positives = int(np.sum(y_true == y_pred))
+        false_positives = y_true.size - true_positives
+        return ValidationResult(true_positives, 0, false_positives, 0, description, y_true=y_true, y_pred=y_pred,
+                                distances=np.asarray(distances, dtype=np.float), fold_statistics=fold_statistics)
+
+    @staticmethod
+    def from_folds(fold_results, description):
+        """Creates a ValidationResult from a list of evaluate_fold results.
+        """
+        y_true, y_pred, distances, fold_statistics = zip(*fold_results)
+        return ValidationResult.from_predictions(np.concatenate(y_true), np.concatenate(y_pred),
+                                                 np.concatenate(distances), description, list(fold_statistics))
+
+    @property
+    def has_predictions(self):
+        return getattr(self, 'y_true', None) is not None
+
+    def confusion_matrix(self, num_classes=None):
+        return confusion_matrix(self.y_true, self.y_pred, num_classes)
+
+    def precision_recall(self):
+        return precision_recall(self.confusion_matrix())
+
+    def roc(self):
+        return roc_curve(self.y_true == self.y_pred, self.distances)
+
+    def equal_error_rate(self):
+        return equal_error_rate(*self.roc())
 
     def __repr__(self):
         res_precision = precision(self.true_positives, self.false_positives) * 100
         res_accuracy = accuracy(self.true_positives, self.true_negatives, self.false_positives,
                                 self.false_negatives) * 100
+        if self.has_predictions and np.any(~np.isnan(self.distances)):
+            eer, threshold = self.equal_error_rate()
+            return "ValidationResult (Description=%s, Precision=%.2f%%, Accuracy=%.2f%%, EER=%.2f%% at %.4f)" % (
+                self.description, res_precision, res_accuracy, eer * 100, threshold)
         return "ValidationResult (Description=%s, Precision=%.2f%%, Accuracy=%.2f%%)" % (
             self.description, res_precision, res_accuracy)
 
@@ -154,6 +381,19 @@ class ValidationStrategy(object):
     def add(self, validation_result):
         self.validation_results.append(validation_result)
 
+    def precompute(self, X, y):
+        """ Computes the leading stateless stages of the model once for the whole dataset,
+            so the folds only need to compute the remaining (learned) stages.
+
+        Returns:
+
+            (X, model) the precomputed data and the model to train on it.
+        """
+        prefix, model = split_stateless(self.model)
+        if prefix is None:
+            return X, self.model
+        return prefix.compute(X, y), model
+
     def validate(self, X, y, description):
         """
         
@@ -170,15 +410,82 @@ class ValidationStrategy(object):
         print self.model
         for validation_result in self.validation_results:
             print validation_result
+            if validation_result.has_predictions:
+                class_precision, class_recall = validation_result.precision_recall()
+                for label in range(0, len(class_precision)):
+                    print "    Class %d: Precision=%.2f%%, Recall=%.2f%%" % (
+                        label, class_precision[label] * 100, class_recall[label] * 100)
+            for i, fold_statistics in enumerate(getattr(validation_result, 'fold_statistics', [])):
+                print "    Fold %d: %s" % (i + 1, fold_statistics)
 
     def __repr__(self):
         return "Validation Kernel (model=%s)" % (self.model)
 
 
+class StratifiedKFold(object):
+    """
+    Splits the samples into k stratified folds. The samples of every class are
+    shuffled and dealt round-robin to the folds, continuing with the next fold
+    where the previous class stopped. So every sample is tested exactly once,
+    each class is spread evenly over the folds and the fold sizes differ by at
+    most one sample. A class with less than k samples is tested in less folds.
+
+    Here is a 3-fold example for 7 observations of 2 classes, the number is the fold
+    an observation is tested in:
+
+        o0 o1 o2 o3
+    c0 | 0  1  2  0 |
+    c1 | 1  2  0    |
+    """
+
+    def __init__(self, y, k=10, seed=None):
+        """
+        Args:
+            y [1 x num_data] classes
+            k [int] number of folds, at most the number of samples (default 10)
+            seed [int] seed for a reproducible split (default: None)
+        """
+        self.y = np.asarray(y)
+        self.k = max(1, min(k, len(self.y)))
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        self.assignment = np.empty(len(self.y), dtype=np.int)
+        offset = 0
+        for c in np.unique(self.y):
+            idx = np.where(self.y == c)[0]
+            idx = idx[rng.permutation(len(idx))]
+            self.assignment[idx] = (offset + np.arange(len(idx))) % self.k
+            offset = offset + len(idx)
+
+    def test_indices(self, i):
+        """ Returns the indices of the samples tested in fold i.
+        """
+        return np.where(self.assignment == i)[0]
+
+    def train_indices(self, i):
+        """ Returns the indices of the samples trained on in fold i.
+        """
+        return np.where(self.assignment != i)[0]
+
+    def folds(self):
+        """ Returns the (trainIdx, testIdx) pairs of all folds.
+        """
+        return [(self.train_indices(i), self.test_indices(i)) for i in range(0, self.k)]
+
+    def __len__(self):
+        return self.k
+
+    def __iter__(self):
+        return iter(self.folds())
+
+    def __repr__(self):
+        return "Stratified k-Fold (k=%s, seed=%s)" % (self.k, self.seed)
+
+
 class KFoldCrossValidation(ValidationStrategy):
     """ 
     
-    Divides the Data into 10 equally spaced and non-overlapping folds for training and testing.
+    Divides the Data into k stratified and non-overlapping folds for training and testing (see StratifiedKFold).
     
     Here is a 3-fold cross validation example for 9 observations and 3 classes, so each observation is given by its index [c_i][o_i]:
                 
@@ -187,16 +494,20 @@ class KFoldCrossValidation(ValidationStrategy):
     c1 | A  B  B |  c1 | B  A  B |  c1 | B  B  A |
     c2 | A  B  B |  c2 | B  A  B |  c2 | B  B  A |
     
-    Please note: If there are less than k observations in a class, k is set to the minimum of observations available through all classes.
+    Every observation is tested exactly once, which observations share a fold is drawn at random (reproducible with a seed).
     """
 
-    def __init__(self, model, k=10):
+    def __init__(self, model, k=10, num_processes=1, seed=None):
         """
         Args:
             k [int] number of folds in this k-fold cross-validation (default 10)
+            num_processes [int] number of worker processes evaluating the folds in parallel (default 1)
+            seed [int] seed for splitting the data and seeding each fold's worker (default: None)
         """
         super(KFoldCrossValidation, self).__init__(model=model)
         self.k = k
+        self.num_processes = num_processes
+        self.seed = seed
         self.logger = logging.getLogger("facerec.validation.KFoldCrossValidation")
 
     def validate(self, X, y, description="ExperimentName"):
@@ -207,55 +518,37 @@ class KFoldCrossValidation(ValidationStrategy):
             X [dim x num_data] input data to validate on
             y [1 x num_data] classes
         """
-        X, y = shuffle(X, y)
-        c = len(np.unique(y))
-        foldIndices = []
-        n = np.iinfo(np.int).max
-        for i in range(0, c):
-            idx = np.where(y == i)[0]
-            n = min(n, idx.shape[0])
-            foldIndices.append(idx.tolist());
-
-            # I assume all folds to be of equal length, so the minimum
-        # number of samples in a class is responsible for the number
-        # of folds. This is probably not desired. Please adjust for
-        # your use case.
-        if n < self.k:
-            self.k = n
-
-        foldSize = int(math.floor(n / self.k))
-
-        true_positives, false_positives, true_negatives, false_negatives = (0, 0, 0, 0)
-        for i in range(0, self.k):
-
-            self.logger.info("Processing fold %d/%d." % (i + 1, self.k))
-
-            # calculate indices
-            l = int(i * foldSize)
-            h = int((i + 1) * foldSize)
-            testIdx = slice_2d(foldIndices, cols=range(l, h), rows=range(0, c))
-            trainIdx = slice_2d(foldIndices, cols=range(0, l), rows=range(0, c))
-            trainIdx.extend(slice_2d(foldIndices, cols=range(h, n), rows=range(0, c)))
-
-            # build training data subset
-            Xtrain = [X[t] for t in trainIdx]
-            ytrain = y[trainIdx]
-
-            self.model.compute(Xtrain, ytrain)
-
-            # TODO I have to add the true_negatives and false_negatives. Models also need to support it,
-            # so we should use a PredictionResult, instead of trying to do this by simply comparing
-            # the predicted and actual class.
-            #
-            # This is inteneded of the next version! Feel free to contribute.
-            for j in testIdx:
-                prediction = self.model.predict(X[j])[0]
-                if prediction == y[j]:
-                    true_positives = true_positives + 1
-                else:
-                    false_positives = false_positives + 1
-
-        self.add(ValidationResult(true_positives, true_negatives, false_positives, false_negatives, description))
+        y = np.asarray(y)
+        X, model = self.precompute(X, y)
+        folds = self.folds(y)
+
+        if self.num_processes > 1 and len(folds) > 1:
+            self.logger.info("Processing %d folds in %d processes." % (len(folds), self.num_processes))
+            tasks = [(trainIdx, testIdx, self._fold_seed(i)) for i, (trainIdx, testIdx) in enumerate(folds)]
+            pool = worker_pool(min(self.num_processes, len(folds)), model=model, X=X, y=y)
+            try:
+                fold_results = pool.map(_evaluate_fold_worker, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            fold_results = []
+            for i, (trainIdx, testIdx) in enumerate(folds):
+                self.logger.info("Processing fold %d/%d." % (i + 1, len(folds)))
+                _seed_fold(self._fold_seed(i))
+                fold_results.append(evaluate_fold(model, X, y, trainIdx, testIdx))
+
+        self.add(ValidationResult.from_folds(fold_results, description))
+
+    def _fold_seed(self, i):
+        if self.seed is None:
+            return None
+        return self.seed + i
+
+    def folds(self, y):
+        """ Returns the (trainIdx, testIdx) pairs of all folds.
+        """
+        return StratifiedKFold(y, self.k, self.seed).folds()
 
     def __repr__(self):
         return "k-Fold Cross Validation (model=%s, k=%s)" % (self.model, self.k)
@@ -291,8 +584,15 @@ class LeaveOneOutCrossValidation(ValidationStrategy):
             y [1 x num_data] classes
         """
         #(X,y) = shuffle(X,y)
-        true_positives, false_positives, true_negatives, false_negatives = (0, 0, 0, 0)
+        y = np.asarray(y)
+        # a single sample has no other sample to be the nearest neighbor, take the regular path
+        if isinstance(self.model.classifier, NearestNeighbor) and self.model.feature.stateless and y.shape[0] > 1:
+            self.logger.info("Stateless feature, using the distance matrix for all %d folds." % y.shape[0])
+            self.validate_distance_matrix(X, y, description)
+            return
+        X, model = self.precompute(X, y)
         n = y.shape[0]
+        fold_results = []
         for i in range(0, n):
 
             self.logger.info("Processing fold %d/%d." % (i + 1, n))
@@ -302,21 +602,53 @@ class LeaveOneOutCrossValidation(ValidationStrategy):
             trainIdx.extend(range(0, i))
             trainIdx.extend(range(i + 1, n))
 
-            # build training data/test data subset
-            Xtrain = [X[t] for t in trainIdx]
-            ytrain = y[trainIdx]
+            # compute the model and get the prediction
+            fold_results.append(evaluate_fold(model, X, y, trainIdx, [i]))
 
-            # compute the model
-            self.model.compute(Xtrain, ytrain)
+        self.add(ValidationResult.from_folds(fold_results, description))
 
-            # get prediction
-            prediction = self.model.predict(X[i])[0]
-            if prediction == y[i]:
-                true_positives = true_positives + 1
-            else:
-                false_positives = false_positives + 1
+    def validate_distance_matrix(self, X, y, description="ExperimentName", max_elements=2 ** 22):
+        """ Performs a LOOCV for a stateless feature and a NearestNeighbor classifier.
 
-        self.add(ValidationResult(true_positives, true_negatives, false_positives, false_negatives, description))
+        The features are extracted once. The pairwise distances are computed in blocks
+        of rows, the distance of each sample to itself is masked and every prediction
+        is the majority of the k nearest remaining samples, just like the classifier
+        would predict it after training on all other samples.
+
+        Args:
+            X [dim x num_data] input data to validate on
+            y [1 x num_data] classes
+            max_elements [int] upper bound for the elements of a block of the distance matrix
+        """
+        y = np.asarray(y)
+        if y.shape[0] < 2:
+            raise ValueError("A distance matrix LOOCV needs at least two samples.")
+        classifier = self.model.classifier
+        baseline = reset_peak_memory()
+        start = time.time()
+        features = self.model.feature.compute(X, y)
+        F = as_rows(features, dtype=np.float)
+        feature_time = time.time() - start
+        n = F.shape[0]
+        k = min(classifier.k, n - 1)
+        rows = max(1, max_elements // n)
+        y_pred = np.empty(n, dtype=np.int)
+        distances = np.empty(n, dtype=np.float)
+        predict_times = np.empty(n, dtype=np.float)
+        for i in range(0, n, rows):
+            start = time.time()
+            D = classifier.dist_metric.pairwise(F[i:i + rows], F)
+            block = np.arange(D.shape[0])
+            D[block, i + block] = np.inf
+            nearest = np.argsort(D, axis=1)[:, 0:k]
+            distances[i:i + D.shape[0]] = D[block, nearest[:, 0]]
+            for j, labels in enumerate(y[nearest]):
+                y_pred[i + j] = np.argmax(np.bincount(labels))
+            # the samples of a block are predicted together, so share its time
+            predict_times[i:i + D.shape[0]] = (time.time() - start) / D.shape[0]
+        # a single "fold" without training, the model would only hold the features
+        statistics = FoldStatistics(feature_time, 0.0, predict_times, peak_memory(baseline), F.nbytes)
+        self.add(ValidationResult.from_predictions(y, y_pred, distances, description, [statistics]))
 
     def __repr__(self):
         return "Leave-One-Out Cross Validation (model=%s)" % (self.model)
@@ -348,28 +680,17 @@ class LeaveOneClassOutCrossValidation(ValidationStrategy):
         """
         TODO Add example and refactor into proper interface declaration.
         """
-        true_positives, false_positives, true_negatives, false_negatives = (0, 0, 0, 0)
+        X, model = self.precompute(X, g)
+        fold_results = []
 
         for i in range(0, len(np.unique(y))):
             self.logger.info("Validating Class %s." % i)
             # create folds
             trainIdx = np.where(y != i)[0]
             testIdx = np.where(y == i)[0]
-            # build training data/test data subset
-            Xtrain = [X[t] for t in trainIdx]
-            gtrain = g[trainIdx]
-
             # Compute the model, this time on the group:
-            self.model.compute(Xtrain, gtrain)
-
-            for j in testIdx:
-                # get prediction
-                prediction = self.model.predict(X[j])[0]
-                if prediction == g[j]:
-                    true_positives = true_positives + 1
-                else:
-                    false_positives = false_positives + 1
-        self.add(ValidationResult(true_positives, true_negatives, false_positives, false_negatives, description))
+            fold_results.append(evaluate_fold(model, X, g, trainIdx, testIdx))
+        self.add(ValidationResult.from_folds(fold_results, description))
 
     def __repr__(self):
         return "Leave-One-Class-Out Cross Validation (model=%s)" % (self.model)
@@ -398,21 +719,21 @@ class SimpleValidation(ValidationStrategy):
         """
         self.logger.info("Simple Validation.")
 
-        self.model.compute(Xtrain, ytrain)
+        baseline = reset_peak_memory()
+        start = time.time()
+        features = self.model.feature.compute(Xtrain, ytrain)
+        feature_time = time.time() - start
+        start = time.time()
+        self.model.classifier.compute(features, ytrain)
+        train_time = time.time() - start
 
         self.logger.debug("Model computed.")
 
-        true_positives, false_positives, true_negatives, false_negatives = (0, 0, 0, 0)
-        count = 0
-        for i in ytest:
-            self.logger.debug("Predicting %s/%s." % (count, len(ytest)))
-            prediction = self.model.predict(Xtest[i])[0]
-            if prediction == ytest[i]:
-                true_positives = true_positives + 1
-            else:
-                false_positives = false_positives + 1
-            count = count + 1
-        self.add(ValidationResult(true_positives, true_negatives, false_positives, false_negatives, description))
+        self.logger.debug("Predicting %s samples." % len(ytest))
+        predictions, distances, predict_times = predict_all(self.model, Xtest, range(0, len(ytest)))
+        statistics = FoldStatistics(feature_time, train_time, predict_times, peak_memory(baseline),
+                                    array_nbytes(self.model))
+        self.add(ValidationResult.from_predictions(ytest, predictions, distances, description, [statistics]))
 
     def __repr__(self):
         return "Simple Validation (model=%s)" % (self.model)
@@ -0,0 +1,99 @@
+# Copyright (c) 2015.
+# Philipp Wagner <bytefish[at]gmx[dot]de> and
+# Florian Lier <flier[at]techfak.uni-bielefeld.de> and
+# Norman Koester <nkoester[at]techfak.uni-bielefeld.de>
+#
+#
+# Released to public domain under terms of the BSD Simplified license.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the organization nor the names of its contributors
+#     may be used to endorse or promote products derived from this software
+#     without specific prior written permission.
+#
+#    See <http://www.opensource.org/licenses/bsd-license>
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+from ocvfacerec.facerec.serialization import load_model
+from ocvfacerec.trainer.thetrainer import ExtendedPredictableModel
+
+
+class ModelLoader(object):
+    """
+    Loads a model file in a background thread, so a recognizer keeps processing
+    frames while a retrained model is loaded. The recognizer calls swap between
+    two frames to replace its model reference with the new one.
+    """
+
+    def __init__(self, model_filename):
+        self.model_filename = model_filename
+        self.lock = threading.Lock()
+        self.pending = None
+        self.loading = False
+        self.reload_again = False
+
+    def request_reload(self):
+        """
+        Starts loading the model file. If a load is already running, the file is loaded
+        once more afterwards, as it may have been replaced in between.
+        """
+        with self.lock:
+            if self.loading:
+                self.reload_again = True
+                return
+            self.loading = True
+        self._start()
+
+    def _start(self):
+        thread = threading.Thread(target=self._load)
+        thread.daemon = True
+        thread.start()
+
+    def _load(self):
+        model = None
+        try:
+            model = load_model(self.model_filename)
+            if not isinstance(model, ExtendedPredictableModel):
+                print ">> [Error] The given model is not of type '%s'." % "ExtendedPredictableModel"
+                model = None
+        except Exception, e:
+            print ">> [Error] Unable to load the model '%s': %s" % (self.model_filename, e)
+        with self.lock:
+            if model is not None:
+                self.pending = model
+            again = self.reload_again
+            self.reload_again = False
+            self.loading = again
+        if again:
+            self._start()
+
+    def swap(self, model):
+        """
+        Returns the newly loaded model if one is ready, else the given model.
+        """
+        with self.lock:
+            new_model = self.pending
+            self.pending = None
+        if new_model is None:
+            return model
+        print ">> Swapped Model --> Known Persons: ", ", ".join(new_model.subject_names.values())
+        return new_model
@@ -0,0 +1,151 @@
+# Copyright (c) 2015.
+# Philipp Wagner <bytefish[at]gmx[dot]de> and
+# Florian Lier <flier[at]techfak.uni-bielefeld.de> and
+# Norman Koester <nkoester[at]techfak.uni-bielefeld.de>
+#
+#
+# Released to public domain under terms of the BSD Simplified license.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the organization nor the names of its contributors
+#     may be used to endorse or promote products derived from this software
+#     without specific prior written permission.
+#
+#    See <http://www.opensource.org/licenses/bsd-license>
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import os
+import re
+import glob
+import cPickle
+import numpy as np
+
+
+class ImageCache(object):
+    """ Caches the decoded, resized grayscale images of a dataset folder, so a training
+        run only decodes new or changed files. The images are stored as one
+        [num_images x height x width] uint8 array (memory-mapped on loading) next to an
+        index, which maps the path of each file to its modification time, file size and
+        row. Both files are kept in the dataset folder, one index per image size. The
+        index names its array file, so replacing the index switches to a new array
+        atomically.
+    """
+
+    def __init__(self, path, image_size):
+        self.path = path
+        self.image_size = image_size
+        self.name = ".ocvf_cache_%dx%d" % tuple(image_size)
+        self.index_filename = os.path.join(path, self.name + ".idx")
+        self.array_filename = None
+        self.index = {}
+        self.images = None
+        self._load()
+        self.new_index = {}
+        self.new_images = []
+        self.changed = False
+
+    def _load(self):
+        try:
+            with open(self.index_filename, 'rb') as f:
+                array_name, index = cPickle.load(f)
+            array_filename = os.path.join(self.path, array_name)
+            images = np.load(array_filename, mmap_mode='r')
+        except (IOError, OSError, EOFError, ValueError, TypeError, cPickle.UnpicklingError):
+            # no (or an unreadable) cache, everything is decoded again
+            return
+        if len(index) > 0 and max(row for mtime, size, row in index.values()) >= images.shape[0]:
+            return
+        self.index, self.images, self.array_filename = index, images, array_filename
+
+    @staticmethod
+    def _stat(filename):
+        st = os.stat(filename)
+        return st.st_mtime, st.st_size
+
+    def lookup(self, filename):
+        """ Returns the cached image of filename, or None if it isn't cached or the file
+            changed since.
+        """
+        entry = self.index.get(os.path.relpath(filename, self.path))
+        mtime, size = self._stat(filename)
+        if entry is not None and entry[0] == mtime and entry[1] == size:
+            return self.images[entry[2]]
+        return None
+
+    def add(self, filename, im, decoded=True):
+        """ Adds the image of filename to the cache written by save. Images are added in
+            the order they are read, decoded is False for images returned by lookup.
+        """
+        key = os.path.relpath(filename, self.path)
+        mtime, size = self._stat(filename)
+        self.new_index[key] = (mtime, size, len(self.new_images))
+        self.new_images.append(np.asarray(im, dtype=np.uint8))
+        self.changed = self.changed or decoded
+
+    def remove_folder(self, folder):
+        """ Rewrites the cache without the images below a folder of the dataset (given
+            relative to the dataset folder), so none of their pixels remain in it.
+        """
+        prefix = os.path.join(folder, '')
+        for key, (mtime, size, row) in sorted(self.index.iteritems(), key=lambda item: item[1][2]):
+            if not key.startswith(prefix):
+                self.new_index[key] = (mtime, size, len(self.new_images))
+                self.new_images.append(self.images[row])
+        self.changed = True
+        self.save()
+
+    def save(self):
+        """ Writes the images requested since loading, if any of them were decoded or files
+            were removed. The files are replaced atomically.
+        """
+        if not self.changed and len(self.new_index) == len(self.index):
+            return
+        if len(self.new_images) > 0:
+            images = np.empty((len(self.new_images),) + self.new_images[0].shape, dtype=np.uint8)
+            for i, im in enumerate(self.new_images):
+                images[i] = im
+        else:
+            images = np.empty((0,) + tuple(reversed(self.image_size)), dtype=np.uint8)
+        array_name = "%s.%s.npy" % (self.name, os.urandom(4).encode('hex'))
+        with open(os.path.join(self.path, array_name), 'wb') as f:
+            np.save(f, images)
+        tmp_filename = "%s.tmp%d" % (self.index_filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            cPickle.dump((array_name, self.new_index), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_filename, self.index_filename)
+        self.array_filename = os.path.join(self.path, array_name)
+        # remove all other arrays, including the ones left by crashed runs. Readers, which
+        # mapped one of them, keep it until they are done.
+        for filename in glob.glob(os.path.join(self.path, self.name + ".*.npy")):
+            if os.path.basename(filename) != array_name:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+
+def remove_folder_from_caches(path, folder):
+    """ Removes the images below folder from the caches of all image sizes in the dataset
+        folder path.
+    """
+    for index_filename in glob.glob(os.path.join(path, ".ocvf_cache_*.idx")):
+        match = re.match(r"^\.ocvf_cache_(\d+)x(\d+)\.idx$", os.path.basename(index_filename))
+        if match is not None:
+            ImageCache(path, (int(match.group(1)), int(match.group(2)))).remove_folder(folder)
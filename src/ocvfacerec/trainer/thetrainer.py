@@ -34,18 +34,24 @@
 
 # STD Imports
 import os
+import shutil
 import cv2
 import sys
 import logging
 import numpy as np
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 # OCVF imports
 from ocvfacerec.facerec.feature import Fisherfaces
+from ocvfacerec.facerec.dataset import NumericDataSet
+from ocvfacerec.trainer.imagecache import ImageCache, remove_folder_from_caches
 from ocvfacerec.facerec.model import PredictableModel
 from ocvfacerec.facerec.distance import EuclideanDistance
 from ocvfacerec.facerec.classifier import NearestNeighbor
 from ocvfacerec.facerec.validation import KFoldCrossValidation
-from ocvfacerec.facerec.serialization import save_model
+from ocvfacerec.facerec.serialization import save_model, load_model, load_metadata, append_gallery, \
+    compact_gallery, gallery_log_filename
 
 
 class ExtendedPredictableModel(PredictableModel):
@@ -59,55 +65,153 @@ class ExtendedPredictableModel(PredictableModel):
         PredictableModel.__init__(self, feature=feature, classifier=classifier)
         self.image_size = image_size
         self.subject_names = subject_names
+        # True once persons were removed from the classifier, but the feature was still
+        # learned with their images. Retrain the model to remove them completely.
+        self.projection_stale = False
+
+    def remove_subject(self, name, mark_stale=True):
+        """ Removes a person from the classifier and the subject names without retraining.
+            The labels above the person's label move down by one.
+
+        Args:
+            name: The name of the person.
+            mark_stale: Marks the projection as stale, as it was learned with the person.
+
+        Returns:
+            The number of removed samples.
+        """
+        labels = [label for label, subject_name in self.subject_names.iteritems() if subject_name == name]
+        if len(labels) == 0:
+            raise ValueError("Unknown subject '%s'." % name)
+        label = labels[0]
+        num_removed = self.classifier.remove(label)
+        self.subject_names = dict((l if l < label else l - 1, subject_name)
+                                  for l, subject_name in self.subject_names.iteritems() if l != label)
+        if mark_stale:
+            self.projection_stale = True
+        return num_removed
 
 
 class TheTrainer():
 
-    def __init__(self, _data_set, _image_size, _model_filename, _numfolds=None):
+    # The gallery log is merged into the model file once it grows beyond this size
+    log_compaction_bytes = 64 * 1024 * 1024
+
+    def __init__(self, _data_set, _image_size, _model_filename, _numfolds=None, _num_processes=1, _compact=False,
+                 _use_cache=True, _num_workers=None):
         self.dataset = _data_set
         self.image_size = _image_size
         self.model_filename = _model_filename
         self.numfolds = _numfolds
+        self.num_processes = _num_processes
+        # Compacted models only recognize, see PredictableModel.compact
+        self.compact = _compact
+        # Decoded images are cached in the dataset folder, see ImageCache
+        self.use_cache = _use_cache
+        # Threads decoding the images, one per CPU by default
+        self.num_workers = _num_workers
+        if self.num_workers is None:
+            self.num_workers = multiprocessing.cpu_count()
 
     @staticmethod
-    def read_images(path, image_size=None):
+    def read_images(path, image_size=None, cache=False, num_workers=1):
         """Reads the images in a given folder, resizes images on the fly if size is given.
 
         Args:
             path: Path to a folder with subfolders representing the subjects (persons).
             sz: A tuple with the size Resizes
+            cache: Keeps the resized images in an ImageCache in the folder, so only new or
+                changed files are decoded next time (only if a size is given).
+            num_workers: Number of threads decoding and resizing the images. OpenCV releases
+                the GIL meanwhile, the order of the images and labels doesn't change.
 
         Returns:
             A list [X, y, folder_names]
 
-                X: The images, which is a Python list of numpy arrays.
-                y: The corresponding labels (the unique number of the subject, person) in a Python list.
+                X: The images, which is a Python list of numpy arrays. If a size is given,
+                    it is a [num_images x height x width] array of a NumericDataSet instead.
+                y: The corresponding labels (the unique number of the subject, person) in a Python list
+                    (an array, if a size is given).
                 folder_names: The names of the folder, so you can display it in a prediction.
         """
-        c = 0
-        X = []
-        y = []
-        folder_names = []
+        # Collect the files of all subjects first, so they can be decoded in parallel:
+        subjects = []
         for dirname, dirnames, filenames in os.walk(path):
             for subdirname in dirnames:
                 # only if there are images in the folder
                 if os.listdir(os.path.join(dirname, subdirname)):
-                    folder_names.append(subdirname)
                     subject_path = os.path.join(dirname, subdirname)
-                    for filename in os.listdir(subject_path):
-                        try:
-                            im = cv2.imread(os.path.join(subject_path, filename), cv2.IMREAD_GRAYSCALE)
-                            # Resize to given size (if given)
-                            if image_size is not None:
-                                im = cv2.resize(im, image_size)
-                            X.append(np.asarray(im, dtype=np.uint8))
-                            y.append(c)
-                        except IOError, (errno, strerror):
-                            print ">> I/O error({0}): {1}".format(errno, strerror)
-                        except:
-                            print ">> Unexpected error:", sys.exc_info()[0]
-                            raise
-                    c = c + 1
+                    subjects.append((subject_path, subdirname,
+                                     [os.path.join(subject_path, filename) for filename in os.listdir(subject_path)]))
+        filenames = [filename for subject_path, subdirname, files in subjects for filename in files]
+
+        image_cache = None
+        if cache and image_size is not None:
+            image_cache = ImageCache(path, image_size)
+        images = [None] * len(filenames)
+        if image_cache is not None:
+            images = [image_cache.lookup(filename) for filename in filenames]
+        missing = [i for i, im in enumerate(images) if im is None]
+
+        def read(i):
+            try:
+                im = cv2.imread(filenames[i], cv2.IMREAD_GRAYSCALE)
+                # Resize to given size (if given)
+                if image_size is not None:
+                    im = cv2.resize(im, image_size)
+                return np.asarray(im, dtype=np.uint8)
+            except IOError, (errno, strerror):
+                print ">> I/O error({0}): {1}".format(errno, strerror)
+            except:
+                print ">> Unexpected error:", sys.exc_info()[0]
+                raise
+
+        if num_workers > 1 and len(missing) > 1:
+            pool = ThreadPool(processes=min(num_workers, len(missing)))
+            try:
+                decoded = pool.map(read, missing)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            decoded = [read(i) for i in missing]
+        for i, im in zip(missing, decoded):
+            images[i] = im
+        missing = set(missing)
+
+        X = []
+        y = []
+        folder_names = []
+        # images of a fixed size go into one array, the subjects are identified by their path
+        dataset = None
+        if image_size is not None:
+            dataset = NumericDataSet()
+        subject_names = {}
+        i = 0
+        for c, (subject_path, subdirname, files) in enumerate(subjects):
+            folder_names.append(subdirname)
+            subject_names[subject_path] = subdirname
+            for filename in files:
+                im = images[i]
+                decoded = i in missing
+                i = i + 1
+                if im is None:
+                    continue
+                if image_cache is not None:
+                    image_cache.add(filename, im, decoded)
+                if dataset is not None:
+                    dataset.add(subject_path, im)
+                else:
+                    X.append(im)
+                    y.append(c)
+        if image_cache is not None:
+            try:
+                image_cache.save()
+            except (IOError, OSError), e:
+                print ">> Unable to write the image cache: ", e
+        if dataset is not None:
+            X, y = dataset.get()
+            folder_names = [subject_names[dataset.resolve_by_num(i)] for i in xrange(dataset.length())]
         return [X, y, folder_names]
 
     @staticmethod
@@ -139,15 +243,22 @@ class TheTrainer():
                 folder_names.append(subdirname)
         return folder_names
 
-    def train(self):
-        # Check if the given dataset exists:
-        if not os.path.exists(self.dataset):
-            print ">> [Error] No Dataset Found at '%s'." % self.dataset
-            sys.exit(1)
-        # Reads the images, labels and folder_names from a given dataset. Images
-        # are resized to given size on the fly:
-        print ">> Loading Dataset <-- " + self.dataset
-        [images, labels, subject_names] = self.read_images(self.dataset, self.image_size)
+    def train(self, data=None):
+        """Trains and saves the model. Pass the result of read_images as data, if the
+            dataset was read already.
+        """
+        if data is not None:
+            [images, labels, subject_names] = data
+        else:
+            # Check if the given dataset exists:
+            if not os.path.exists(self.dataset):
+                print ">> [Error] No Dataset Found at '%s'." % self.dataset
+                sys.exit(1)
+            # Reads the images, labels and folder_names from a given dataset. Images
+            # are resized to given size on the fly:
+            print ">> Loading Dataset <-- " + self.dataset
+            [images, labels, subject_names] = self.read_images(self.dataset, self.image_size, self.use_cache,
+                                                                   self.num_workers)
         # Zip us a {label, name} dict from the given data:
         list_of_labels = list(xrange(max(labels) + 1))
         subject_dictionary = dict(zip(list_of_labels, subject_names))
@@ -168,12 +279,81 @@ class TheTrainer():
             logger.addHandler(handler)
             logger.setLevel(logging.DEBUG)
             # Perform the validation & print results:
-            crossval = KFoldCrossValidation(model, k=self.numfolds)
+            crossval = KFoldCrossValidation(model, k=self.numfolds, num_processes=self.num_processes)
             crossval.validate(images, labels)
             crossval.print_results()
         # Compute the model:
         print ">> Computing Model.."
         model.compute(images, labels)
+        if self.compact:
+            bytes_before, bytes_after = model.compact()
+            print ">> Compacted Model From %.1f To %.1f MB" % (bytes_before / 1048576.0, bytes_after / 1048576.0)
         # And save the model, which uses Pythons pickle module:
         print ">> Saving Model.."
         save_model(self.model_filename, model)
+
+    def remove_subject(self, name, delete_images=False):
+        """Removes a person from the saved model without retraining it. The model file
+            is saved again with its gallery log merged, so none of the person's samples
+            remain in the model file or its log.
+
+        Args:
+            name: The name of the person.
+            delete_images: Also deletes the person's folder in the dataset and the person's
+                images in the image caches, otherwise the person is learned again by the
+                next train().
+
+        Returns:
+            The number of removed samples.
+        """
+        removed = []
+        compact_gallery(self.model_filename, lambda model: removed.append(model.remove_subject(name)))
+        print ">> Removed '%s' (%d Samples) From %s" % (name, removed[0], self.model_filename)
+        if delete_images:
+            shutil.rmtree(os.path.join(self.dataset, name), ignore_errors=True)
+            remove_folder_from_caches(self.dataset, name)
+        return removed[0]
+
+    def enroll(self, name, images):
+        """Adds a person to the saved model without retraining it. The images are
+            projected with the existing feature and appended to the gallery log of
+            the model file, which is merged into the model once it gets large. A
+            person known to the model gets more samples.
+
+            The projection isn't learned with the new images, so a full train()
+            recognizes new persons better, when there's time for it.
+
+        Args:
+            name: The name of the person.
+            images: Grayscale images of the person's face.
+
+        Returns:
+            The label of the person.
+        """
+        try:
+            generation = load_metadata(self.model_filename).get('generation')
+        except ValueError:
+            # pickled by a former version
+            generation = None
+        if generation is None:
+            # only models saved with a generation can have a gallery log, save it once again
+            print ">> Saving the Model with a Gallery Log.."
+            compact_gallery(self.model_filename)
+        model = load_model(self.model_filename)
+        labels = [label for label, subject_name in model.subject_names.iteritems() if subject_name == name]
+        if len(labels) > 0:
+            label = labels[0]
+        elif len(model.subject_names) > 0:
+            label = max(model.subject_names.keys()) + 1
+        else:
+            label = 0
+        features = []
+        for im in images:
+            im = np.asarray(cv2.resize(np.asarray(im, dtype=np.uint8), self.image_size), dtype=np.uint8)
+            features.append(model.feature.extract(im))
+        print ">> Enrolling '%s' With %d Images" % (name, len(features))
+        append_gallery(self.model_filename, features, [label] * len(features), {label: name})
+        if os.path.getsize(gallery_log_filename(self.model_filename)) > self.log_compaction_bytes:
+            print ">> Compacting Gallery Log.."
+            compact_gallery(self.model_filename)
+        return label